@@ -19,6 +19,72 @@ NEXTCLOUD_HTTPS: bool = env.bool("NEXTCLOUD_HTTPS")
 NEXTCLOUD_USERNAME: str = env.str("NEXTCLOUD_USERNAME")
 NEXTCLOUD_SECRET: str = env.str("NEXTCLOUD_SECRET")
 
+# Connection pool shared by all forwarder calls. The connector only ever talks to
+# the one Nextcloud host, so the pool-wide limits are also the per-host limits.
+NEXTCLOUD_POOL_MAX_CONNECTIONS: int = env.int("NEXTCLOUD_POOL_MAX_CONNECTIONS", 20)
+NEXTCLOUD_POOL_MAX_KEEPALIVE: int = env.int("NEXTCLOUD_POOL_MAX_KEEPALIVE", 10)
+NEXTCLOUD_POOL_KEEPALIVE_EXPIRY: float = env.float(
+    "NEXTCLOUD_POOL_KEEPALIVE_EXPIRY", 30.0
+)
+NEXTCLOUD_TIMEOUT: float = env.float("NEXTCLOUD_TIMEOUT", 30.0)
+
+# Maximum number of per-user requests in flight at once, e.g. detail fetches when
+# listing users, or the individual changes of a PATCH
+NEXTCLOUD_USERS_CONCURRENCY: int = env.int("NEXTCLOUD_USERS_CONCURRENCY", 10)
+# Maximum number of group member fetches in flight at once when listing groups
+NEXTCLOUD_GROUPS_CONCURRENCY: int = env.int("NEXTCLOUD_GROUPS_CONCURRENCY", 10)
+
+# In-memory cache of user records and group members. A TTL of 0 disables it.
+CONNECTOR_CACHE_TTL: float = env.float("CONNECTOR_CACHE_TTL", 30.0)
+CONNECTOR_CACHE_MAX_ENTRIES: int = env.int("CONNECTOR_CACHE_MAX_ENTRIES", 10000)
+# Counting all users or groups for the totalResults of a paged listing walks Nextcloud's whole
+# ID listing, a page per request, so the counts are cached for longer. Creating or deleting
+# a user or group through the connector, or by a webhook event, drops them sooner.
+CONNECTOR_COUNT_TTL: float = env.float("CONNECTOR_COUNT_TTL", 600.0)
+
+# Local SQLite mirror of the directory, which list and lookup reads are served from
+# while it is fresh. An empty path disables it.
+CONNECTOR_MIRROR_PATH: str = env.str("CONNECTOR_MIRROR_PATH", "")
+CONNECTOR_MIRROR_REFRESH_INTERVAL: float = env.float(
+    "CONNECTOR_MIRROR_REFRESH_INTERVAL", 300.0
+)
+CONNECTOR_MIRROR_MAX_STALENESS: float = env.float(
+    "CONNECTOR_MIRROR_MAX_STALENESS", 900.0
+)
+
+# In-memory index of group memberships, built from the member listings of all groups,
+# which the groups of users and the members of groups are read from while it is fresh.
+CONNECTOR_MEMBERSHIP_INDEX: bool = env.bool("CONNECTOR_MEMBERSHIP_INDEX", False)
+CONNECTOR_MEMBERSHIP_REFRESH_INTERVAL: float = env.float(
+    "CONNECTOR_MEMBERSHIP_REFRESH_INTERVAL", 300.0
+)
+CONNECTOR_MEMBERSHIP_MAX_STALENESS: float = env.float(
+    "CONNECTOR_MEMBERSHIP_MAX_STALENESS", 900.0
+)
+
+# Limits of the /Bulk endpoint, advertised in the ServiceProviderConfig
+CONNECTOR_BULK_MAX_OPERATIONS: int = env.int("CONNECTOR_BULK_MAX_OPERATIONS", 1000)
+CONNECTOR_BULK_MAX_PAYLOAD_SIZE: int = env.int(
+    "CONNECTOR_BULK_MAX_PAYLOAD_SIZE", 1048576
+)
+# Maximum number of bulk operations run at once
+CONNECTOR_BULK_CONCURRENCY: int = env.int("CONNECTOR_BULK_CONCURRENCY", 10)
+
+# Build the responses to writes from the request and the known result of the write,
+# instead of reading the resource back from Nextcloud. PATCH then answers with
+# 204 No Content, unless the `attributes` query parameter asks for some.
+CONNECTOR_SKIP_READ_AFTER_WRITE: bool = env.bool(
+    "CONNECTOR_SKIP_READ_AFTER_WRITE", False
+)
+
+# Shared secret Nextcloud's webhook_listeners app authenticates its change events with, as a
+# bearer token. Applying those events keeps cached state current, so TTLs can be long. An empty
+# secret disables the webhook route.
+CONNECTOR_WEBHOOK_SECRET: str = env.str("CONNECTOR_WEBHOOK_SECRET", "")
+
+# Number of users or groups requested from Nextcloud per page when reading a whole listing
+NEXTCLOUD_PAGE_SIZE: int = env.int("NEXTCLOUD_PAGE_SIZE", 500)
+
 # SCIM_TOKEN = str(raw_config.get("scim", {}).get("token"))
 
 
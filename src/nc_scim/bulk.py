@@ -0,0 +1,134 @@
+"""
+Scheduling of SCIM bulk operations (RFC 7644, section 3.7).
+
+Operations run concurrently, except that an operation waits for the operations whose `bulkId` it references, and for the operation before it on the same path, so that e.g. creating a user and then adding it to a group happen in that order.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import Any, Awaitable, Callable, Optional
+
+from scim2_models import BulkOperation, Error
+
+BULK_ID_REFERENCE = re.compile(r"bulkId:([^/\s]+)")
+
+BulkExecutor = Callable[[BulkOperation], Awaitable[tuple[BulkOperation, Optional[str]]]]
+"""Runs one operation whose `bulkId` references have been resolved, returning its result and the ID of the resource it created, if any."""
+
+
+def bulk_references(value: Any) -> set[str]:
+    """Find every `bulkId:<id>` reference in a path or in (nested) operation data."""
+    if isinstance(value, str):
+        return set(BULK_ID_REFERENCE.findall(value))
+    if isinstance(value, dict):
+        return set().union(*(bulk_references(v) for v in value.values()))
+    if isinstance(value, list):
+        return set().union(*(bulk_references(v) for v in value))
+    return set()
+
+
+def resolve_references(value: Any, resource_ids: dict[str, str]) -> Any:
+    """Replace every `bulkId:<id>` reference with the ID of the resource that operation created."""
+    if isinstance(value, str):
+        return BULK_ID_REFERENCE.sub(lambda m: resource_ids[m.group(1)], value)
+    if isinstance(value, dict):
+        return {k: resolve_references(v, resource_ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve_references(v, resource_ids) for v in value]
+    return value
+
+
+def error_result(operation: BulkOperation, status: int, detail: str) -> BulkOperation:
+    return BulkOperation(
+        method=operation.method,
+        bulk_id=operation.bulk_id,
+        status=status,
+        response=Error(status=status, detail=detail).model_dump(),
+    )
+
+
+async def run_bulk(
+    operations: list[BulkOperation],
+    execute: BulkExecutor,
+    fail_on_errors: Optional[int],
+    concurrency: int,
+) -> list[BulkOperation]:
+    """
+    Run the operations, at most `concurrency` at a time, and return their results in request order.
+
+    Once `fail_on_errors` operations have failed, no further operations are started, and those are left out of the results.
+    """
+    creators = {op.bulk_id: i for i, op in enumerate(operations) if op.bulk_id}
+    references = [bulk_references([op.path, op.data]) for op in operations]
+
+    # Each operation depends on the ones creating what it references, and on the previous one on its path
+    dependencies: list[set[int]] = []
+    last_on_path: dict[Optional[str], int] = {}
+    for i, op in enumerate(operations):
+        deps = {creators[r] for r in references[i] if r in creators}
+        if op.path in last_on_path:
+            deps.add(last_on_path[op.path])
+        last_on_path[op.path] = i
+        dependencies.append(deps)
+
+    # Anything not ordered by this topological sort references itself in a cycle
+    order: list[int] = []
+    remaining = {i: set(deps) for i, deps in enumerate(dependencies)}
+    while ready := [i for i, deps in remaining.items() if not deps]:
+        for i in ready:
+            del remaining[i]
+            order.append(i)
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    resource_ids: dict[str, str] = {}
+    results: list[Optional[BulkOperation]] = [None] * len(operations)
+    errors = 0
+
+    def stopped() -> bool:
+        return fail_on_errors is not None and errors >= fail_on_errors
+
+    async def run(i: int, after: list[asyncio.Task]) -> None:
+        nonlocal errors
+        await asyncio.gather(*after)
+        if stopped():
+            return
+
+        operation = operations[i]
+        if missing := references[i] - resource_ids.keys():
+            result = error_result(
+                operation,
+                409,
+                f"Referenced bulkId(s) {', '.join(sorted(missing))} did not create a resource",
+            )
+        else:
+            async with semaphore:
+                if stopped():
+                    return
+                resolved = operation.model_copy(
+                    update={
+                        "path": resolve_references(operation.path, resource_ids),
+                        "data": resolve_references(operation.data, resource_ids),
+                    }
+                )
+                result, resource_id = await execute(resolved)
+            if operation.bulk_id and resource_id is not None:
+                resource_ids[operation.bulk_id] = resource_id
+
+        if result.status is not None and result.status >= 400:
+            errors += 1
+        results[i] = result
+
+    tasks: dict[int, asyncio.Task] = {}
+    for i in order:
+        tasks[i] = asyncio.create_task(run(i, [tasks[d] for d in dependencies[i]]))
+    await asyncio.gather(*tasks.values())
+
+    for i in remaining:
+        results[i] = error_result(
+            operations[i], 409, "Circular bulkId reference between operations"
+        )
+    return [r for r in results if r is not None]
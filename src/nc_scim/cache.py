@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Bounded in-memory cache where entries expire after `ttl` seconds, and the least recently used entry is evicted once `max_entries` is reached.
+
+    A `ttl` or `max_entries` of 0 disables the cache: nothing is stored and every lookup is a miss.
+
+    Values fetched while an invalidation happens would be stale as soon as they're stored, so callers take the `generation` before fetching and pass it to `set`, which drops the value if its key (or the whole cache) has been invalidated since.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+        self._generation = 0
+        # The generation each recently invalidated key was invalidated in, and the generation
+        # before which values are dropped regardless of key, e.g. after `invalidate_where`
+        self._invalidated: OrderedDict[K, int] = OrderedDict()
+        self._floor = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        """Return the cached value for `key`, or `None` if it is missing or has expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def values(self) -> list[V]:
+        """Every value stored, expired or not."""
+        return [value for _, value in self._entries.values()]
+
+    def expire(self) -> None:
+        """Drop the expired entries, which are otherwise only dropped when looked up or evicted."""
+        now = monotonic()
+        for key in [
+            k for k, (expires_at, _) in self._entries.items() if expires_at <= now
+        ]:
+            del self._entries[key]
+
+    def generation(self) -> int:
+        """The current generation, to pass to `set` along with a value fetched from now on."""
+        return self._generation
+
+    def set(self, key: K, value: V, generation: Optional[int] = None) -> None:
+        if not self.enabled:
+            return
+        if generation is not None and (
+            generation < self._floor or self._invalidated.get(key, -1) > generation
+        ):
+            return
+
+        self._entries[key] = (monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: K) -> None:
+        self._generation += 1
+        for key in keys:
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+        # Forgetting an invalidation is safe as long as nothing fetched before it is stored
+        while len(self._invalidated) > max(self.max_entries, 1):
+            _, generation = self._invalidated.popitem(last=False)
+            self._floor = max(self._floor, generation)
+
+    def invalidate_where(self, predicate: Callable[[K, V], bool]) -> None:
+        """Drop every entry for which `predicate(key, value)` is true."""
+        # Values being fetched can't be checked yet, so none of them are stored
+        self._generation += 1
+        self._floor = self._generation
+        for key in [k for k, (_, v) in self._entries.items() if predicate(k, v)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._floor = self._generation
+        self._entries.clear()
+        self._invalidated.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
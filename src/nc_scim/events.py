@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from nc_scim.models import NCUser
+
+
+class DirectoryListener:
+    """
+    Receives the changes made to Nextcloud's users and groups, so that local state derived from them (caches, the mirror, ...) can be kept current without re-reading Nextcloud.
+
+    Every method is a no-op by default; subclasses override the ones they care about.
+    """
+
+    def user_created(self, user: NCUser) -> None:
+        """`user` is the new user as Nextcloud stores it."""
+        pass
+
+    def user_updated(self, user_id: str, key: str, value: str) -> None:
+        pass
+
+    def user_enabled(self, user_id: str, enabled: bool) -> None:
+        pass
+
+    def user_deleted(self, user_id: str) -> None:
+        pass
+
+    def member_added(self, user_id: str, group_id: str) -> None:
+        pass
+
+    def member_removed(self, user_id: str, group_id: str) -> None:
+        pass
+
+    def group_created(self, group_id: str) -> None:
+        pass
+
+    def group_deleted(self, group_id: str) -> None:
+        pass
+
+
+class DirectoryEvents(DirectoryListener):
+    """Fans every change out to all registered listeners, in registration order."""
+
+    def __init__(self):
+        self.listeners: list[DirectoryListener] = []
+
+    def register(self, listener: DirectoryListener) -> None:
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def unregister(self, listener: DirectoryListener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def user_created(self, user: NCUser) -> None:
+        for listener in self.listeners:
+            listener.user_created(user)
+
+    def user_updated(self, user_id: str, key: str, value: str) -> None:
+        for listener in self.listeners:
+            listener.user_updated(user_id, key, value)
+
+    def user_enabled(self, user_id: str, enabled: bool) -> None:
+        for listener in self.listeners:
+            listener.user_enabled(user_id, enabled)
+
+    def user_deleted(self, user_id: str) -> None:
+        for listener in self.listeners:
+            listener.user_deleted(user_id)
+
+    def member_added(self, user_id: str, group_id: str) -> None:
+        for listener in self.listeners:
+            listener.member_added(user_id, group_id)
+
+    def member_removed(self, user_id: str, group_id: str) -> None:
+        for listener in self.listeners:
+            listener.member_removed(user_id, group_id)
+
+    def group_created(self, group_id: str) -> None:
+        for listener in self.listeners:
+            listener.group_created(group_id)
+
+    def group_deleted(self, group_id: str) -> None:
+        for listener in self.listeners:
+            listener.group_deleted(group_id)
+
+
+directory_events = DirectoryEvents()
+"""Every write made through the forwarder is announced here."""
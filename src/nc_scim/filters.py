@@ -0,0 +1,364 @@
+"""
+SCIM filter expressions (RFC 7644, section 3.4.2.2).
+
+`parse_filter` turns a `filter` query parameter into a tree of `Filter` nodes, which can then be matched against the dumped SCIM representation of a resource. `Filter.search_term` finds a term that Nextcloud's own `search` parameter can narrow a listing down with, so that only the candidates it returns need to be matched locally.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+COMPARISON_OPERATORS = {"eq", "ne", "co", "sw", "ew", "gt", "ge", "lt", "le"}
+
+# Operators whose matches always contain the compared value, and so are also matched by a substring search for it
+SEARCHABLE_OPERATORS = {"eq", "co", "sw"}
+
+# Attributes whose values are compared case-sensitively; everything else this connector exposes is caseExact=false
+CASE_EXACT_ATTRIBUTES = {"id", "externalid"}
+
+USER_SEARCH_ATTRIBUTES = {"username", "displayname", "emails", "emails.value"}
+"""Attributes that Nextcloud's user search looks through (user ID, display name and email address)."""
+
+GROUP_SEARCH_ATTRIBUTES = {"id", "displayname"}
+"""Attributes that Nextcloud's group search looks through (group ID and display name)."""
+
+TOKEN_PATTERN = re.compile(
+    r'\s*(?:(?P<string>"(?:[^"\\]|\\.)*")|(?P<bracket>[()\[\]])|(?P<word>[^\s()\[\]"]+))'
+)
+
+
+class FilterError(ValueError):
+    """The filter expression is not valid."""
+
+
+def normalize_path(path: str) -> str:
+    """Drop the schema URN from a fully qualified attribute path, and lowercase it, as attribute names are case-insensitive."""
+    if path.lower().startswith("urn:"):
+        schema, _, path = path.rpartition(":")
+        if not path:
+            raise FilterError(f"Invalid attribute path '{schema}:'")
+    return path.casefold()
+
+
+def resolve(resource: Any, path: str) -> list[Any]:
+    """Return all values at the (normalized) `path` of a dumped resource, flattening multi-valued attributes along the way."""
+    values = [resource]
+    for name in path.split("."):
+        found = []
+        for value in values:
+            items = value if isinstance(value, list) else [value]
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                for key, child in item.items():
+                    if key.casefold() == name:
+                        found.append(child)
+                        break
+        values = found
+
+    flattened = []
+    for value in values:
+        flattened.extend(value if isinstance(value, list) else [value])
+    return [v for v in flattened if v is not None]
+
+
+def compare(op: str, actual: Any, expected: Any, case_exact: bool) -> bool:
+    # Complex values are compared by their `value` sub-attribute, e.g. `emails eq "..."`
+    if isinstance(actual, dict):
+        actual = next((v for k, v in actual.items() if k.casefold() == "value"), None)
+        if actual is None:
+            return False
+
+    if isinstance(actual, bool) or isinstance(expected, bool):
+        if op != "eq" or not isinstance(actual, bool) or not isinstance(expected, bool):
+            return False
+        return actual == expected
+
+    if isinstance(expected, str):
+        if not isinstance(actual, str):
+            actual = str(actual)
+        if not case_exact:
+            actual, expected = actual.casefold(), expected.casefold()
+    elif not isinstance(actual, (int, float)):
+        return False
+
+    match op:
+        case "eq":
+            return actual == expected
+        case "co":
+            return isinstance(actual, str) and expected in actual
+        case "sw":
+            return isinstance(actual, str) and actual.startswith(expected)
+        case "ew":
+            return isinstance(actual, str) and actual.endswith(expected)
+        case "gt":
+            return actual > expected
+        case "ge":
+            return actual >= expected
+        case "lt":
+            return actual < expected
+        case "le":
+            return actual <= expected
+    return False
+
+
+class Filter(ABC):
+    @abstractmethod
+    def matches(self, resource: dict[str, Any]) -> bool: ...
+
+    @abstractmethod
+    def attributes(self) -> set[str]:
+        """Top-level attributes that the filter looks at."""
+
+    def search_term(self, attributes: Iterable[str]) -> Optional[str]:
+        """
+        Return a string that every matching resource contains in one of the (normalized) `attributes`, or `None` if there is none.
+
+        Searching for it upstream returns a superset of the matches, which only then has to be narrowed down with `matches`.
+        """
+        return None
+
+
+@dataclass(frozen=True)
+class Comparison(Filter):
+    path: str
+    op: str
+    value: Any
+
+    def matches(self, resource: dict[str, Any]) -> bool:
+        values = resolve(resource, self.path)
+        if self.value is None:
+            # `eq null` and `ne null` test for absence and presence
+            return bool(values) == (self.op == "ne")
+        if self.op == "ne":
+            return not Comparison(self.path, "eq", self.value).matches(resource)
+
+        case_exact = self.path in CASE_EXACT_ATTRIBUTES
+        return any(compare(self.op, v, self.value, case_exact) for v in values)
+
+    def attributes(self) -> set[str]:
+        return {self.path.split(".")[0]}
+
+    def search_term(self, attributes: Iterable[str]) -> Optional[str]:
+        if (
+            self.op in SEARCHABLE_OPERATORS
+            and self.path in attributes
+            and isinstance(self.value, str)
+            and self.value
+        ):
+            return self.value
+        return None
+
+
+@dataclass(frozen=True)
+class Present(Filter):
+    path: str
+
+    def matches(self, resource: dict[str, Any]) -> bool:
+        return any(v not in ("", [], {}) for v in resolve(resource, self.path))
+
+    def attributes(self) -> set[str]:
+        return {self.path.split(".")[0]}
+
+
+@dataclass(frozen=True)
+class ValuePath(Filter):
+    """`path[filter]`: at least one value of the multi-valued `path` matches `filter`."""
+
+    path: str
+    filter: Filter
+
+    def matches(self, resource: dict[str, Any]) -> bool:
+        return any(
+            isinstance(v, dict) and self.filter.matches(v)
+            for v in resolve(resource, self.path)
+        )
+
+    def attributes(self) -> set[str]:
+        return {self.path.split(".")[0]}
+
+    def search_term(self, attributes: Iterable[str]) -> Optional[str]:
+        prefix = f"{self.path}."
+        return self.filter.search_term(
+            [a.removeprefix(prefix) for a in attributes if a.startswith(prefix)]
+        )
+
+
+@dataclass(frozen=True)
+class And(Filter):
+    left: Filter
+    right: Filter
+
+    def matches(self, resource: dict[str, Any]) -> bool:
+        return self.left.matches(resource) and self.right.matches(resource)
+
+    def attributes(self) -> set[str]:
+        return self.left.attributes() | self.right.attributes()
+
+    def search_term(self, attributes: Iterable[str]) -> Optional[str]:
+        attributes = list(attributes)
+        return self.left.search_term(attributes) or self.right.search_term(attributes)
+
+
+@dataclass(frozen=True)
+class Or(Filter):
+    left: Filter
+    right: Filter
+
+    def matches(self, resource: dict[str, Any]) -> bool:
+        return self.left.matches(resource) or self.right.matches(resource)
+
+    def attributes(self) -> set[str]:
+        return self.left.attributes() | self.right.attributes()
+
+    def search_term(self, attributes: Iterable[str]) -> Optional[str]:
+        # A single search only covers both branches if they search for the same thing
+        attributes = list(attributes)
+        left = self.left.search_term(attributes)
+        return left if left == self.right.search_term(attributes) else None
+
+
+@dataclass(frozen=True)
+class Not(Filter):
+    filter: Filter
+
+    def matches(self, resource: dict[str, Any]) -> bool:
+        return not self.filter.matches(resource)
+
+    def attributes(self) -> set[str]:
+        return self.filter.attributes()
+
+
+class Parser:
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens: list[tuple[str, str]] = []
+
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = TOKEN_PATTERN.match(expression, position)
+            if match is None:
+                raise FilterError(
+                    f"Invalid filter at position {position}: '{self.expression}'"
+                )
+            kind = match.lastgroup
+            self.tokens.append((kind, match.group(kind)))
+            position = match.end()
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][1]
+        return None
+
+    def peek_keyword(self) -> Optional[str]:
+        if self.position < len(self.tokens) and self.tokens[self.position][0] == "word":
+            return self.tokens[self.position][1].lower()
+        return None
+
+    def take(self) -> tuple[str, str]:
+        if self.position >= len(self.tokens):
+            raise FilterError(f"Unexpected end of filter: '{self.expression}'")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, value: str) -> None:
+        _, token = self.take()
+        if token != value:
+            raise FilterError(
+                f"Expected '{value}' but found '{token}' in filter: '{self.expression}'"
+            )
+
+    def parse(self) -> Filter:
+        if not self.tokens:
+            raise FilterError("Empty filter")
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise FilterError(
+                f"Unexpected '{self.peek()}' in filter: '{self.expression}'"
+            )
+        return node
+
+    def parse_or(self) -> Filter:
+        node = self.parse_and()
+        while self.peek_keyword() == "or":
+            self.take()
+            node = Or(node, self.parse_and())
+        return node
+
+    def parse_and(self) -> Filter:
+        node = self.parse_not()
+        while self.peek_keyword() == "and":
+            self.take()
+            node = And(node, self.parse_not())
+        return node
+
+    def parse_not(self) -> Filter:
+        if self.peek_keyword() == "not":
+            self.take()
+            self.expect("(")
+            node = self.parse_or()
+            self.expect(")")
+            return Not(node)
+        return self.parse_atom()
+
+    def parse_atom(self) -> Filter:
+        if self.peek() == "(":
+            self.take()
+            node = self.parse_or()
+            self.expect(")")
+            return node
+
+        kind, token = self.take()
+        if kind != "word":
+            raise FilterError(
+                f"Expected an attribute but found '{token}' in filter: '{self.expression}'"
+            )
+        path = normalize_path(token)
+
+        if self.peek() == "[":
+            self.take()
+            node = self.parse_or()
+            self.expect("]")
+            return ValuePath(path, node)
+
+        kind, operator = self.take()
+        operator = operator.lower()
+        if kind == "word" and operator == "pr":
+            return Present(path)
+        if kind != "word" or operator not in COMPARISON_OPERATORS:
+            raise FilterError(
+                f"Unknown operator '{operator}' in filter: '{self.expression}'"
+            )
+        return Comparison(path, operator, self.parse_value())
+
+    def parse_value(self) -> Any:
+        kind, token = self.take()
+        if kind == "string":
+            try:
+                return json.loads(token)
+            except ValueError:
+                # e.g. an invalid escape sequence
+                raise FilterError(
+                    f"Invalid string {token} in filter: '{self.expression}'"
+                ) from None
+        if kind == "word":
+            keyword = token.lower()
+            if keyword in ("true", "false", "null"):
+                return json.loads(keyword)
+            try:
+                return json.loads(token)
+            except ValueError:
+                pass
+        raise FilterError(f"Invalid value '{token}' in filter: '{self.expression}'")
+
+
+def parse_filter(expression: str) -> Filter:
+    """Parse a SCIM filter expression, raising `FilterError` if it is invalid."""
+    return Parser(expression).parse()
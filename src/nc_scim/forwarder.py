@@ -1,26 +1,307 @@
 from __future__ import annotations
 
-from typing import Any
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, TypeVar
 
-import requests
+import httpx
+import orjson
 import xmltodict
 from fastapi import HTTPException
 
 from nc_scim import (
+    CONNECTOR_CACHE_MAX_ENTRIES,
+    CONNECTOR_CACHE_TTL,
+    CONNECTOR_COUNT_TTL,
     NEXTCLOUD_BASEURL,
+    NEXTCLOUD_GROUPS_CONCURRENCY,
     NEXTCLOUD_HTTPS,
+    NEXTCLOUD_PAGE_SIZE,
+    NEXTCLOUD_POOL_KEEPALIVE_EXPIRY,
+    NEXTCLOUD_POOL_MAX_CONNECTIONS,
+    NEXTCLOUD_POOL_MAX_KEEPALIVE,
     NEXTCLOUD_SECRET,
+    NEXTCLOUD_TIMEOUT,
     NEXTCLOUD_USERNAME,
+    NEXTCLOUD_USERS_CONCURRENCY,
 )
-from nc_scim.models import NCUser
+from nc_scim.cache import TTLCache
+from nc_scim.events import DirectoryListener, directory_events
+from nc_scim.models import NCGroup, NCGroupDetails, NCUser, NCUserDiff, coerce_to_list
+from nc_scim.records import NAMES, GroupRecord, UserRecord
 
 standard_headers = {"OCS-APIRequest": "true"}
 post_headers = {**standard_headers, "Content-Type": "application/x-www-form-urlencoded"}
 
+# Reads are served from these until they expire or a write through the forwarder invalidates them.
+# Entries are kept as compact records, so that caching a large directory stays cheap.
+user_cache: TTLCache[str, UserRecord] = TTLCache(
+    CONNECTOR_CACHE_TTL, CONNECTOR_CACHE_MAX_ENTRIES
+)
+group_members_cache: TTLCache[str, GroupRecord] = TTLCache(
+    CONNECTOR_CACHE_TTL, CONNECTOR_CACHE_MAX_ENTRIES
+)
+# Number of users and of groups, for the totalResults of paged listings
+listing_size_cache: TTLCache[str, int] = TTLCache(CONNECTOR_COUNT_TTL, 2)
+
+
+class CacheInvalidator(DirectoryListener):
+    """Drops exactly the cache entries a change makes stale."""
+
+    def user_created(self, user: NCUser) -> None:
+        user_cache.invalidate(user.id)
+        group_members_cache.invalidate(*user.groups)
+        listing_size_cache.invalidate("users")
+
+    def user_updated(self, user_id: str, key: str, value: str) -> None:
+        user_cache.invalidate(user_id)
+
+    def user_enabled(self, user_id: str, enabled: bool) -> None:
+        user_cache.invalidate(user_id)
+
+    def user_deleted(self, user_id: str) -> None:
+        user_cache.invalidate(user_id)
+        listing_size_cache.invalidate("users")
+        group_members_cache.invalidate_where(lambda _, group: group.has_member(user_id))
+
+    def member_added(self, user_id: str, group_id: str) -> None:
+        user_cache.invalidate(user_id)
+        group_members_cache.invalidate(group_id)
+
+    def member_removed(self, user_id: str, group_id: str) -> None:
+        user_cache.invalidate(user_id)
+        group_members_cache.invalidate(group_id)
+
+    def group_created(self, group_id: str) -> None:
+        group_members_cache.invalidate(group_id)
+        listing_size_cache.invalidate("groups")
+
+    def group_deleted(self, group_id: str) -> None:
+        group_members_cache.invalidate(group_id)
+        listing_size_cache.invalidate("groups")
+        user_cache.invalidate_where(lambda _, user: user.in_group(group_id))
+
+
+directory_events.register(CacheInvalidator())
+
+
+def compact_names() -> None:
+    """
+    Drop the names the cached records don't reference any more from `NAMES`, so that it doesn't keep every ID ever seen.
+
+    This is done on every full refresh of the mirror or the membership index, and whenever the table has doubled since it was last compacted.
+    """
+    global names_compacted_size
+    user_cache.expire()
+    group_members_cache.expire()
+    users, groups = user_cache.values(), group_members_cache.values()
+
+    in_use: set[int] = set()
+    for user in users:
+        in_use.update(user.groups)
+    for group in groups:
+        in_use.update(group.members)
+    ids = NAMES.compact(in_use)
+    for record in (*users, *groups):
+        record.remap(ids)
+    names_compacted_size = len(NAMES)
+
+
+names_compacted_size = 0
+
+
+def reclaim_names() -> None:
+    """Compact `NAMES` once it has doubled in size since the last time, which keeps the cost of compacting in proportion to the caching."""
+    if len(NAMES) > max(2 * names_compacted_size, CONNECTOR_CACHE_MAX_ENTRIES):
+        compact_names()
 
-def url_assemble(path: str) -> str:
-    protocol = "https" if NEXTCLOUD_HTTPS else "http"
-    return f"{protocol}://{NEXTCLOUD_USERNAME}:{NEXTCLOUD_SECRET}@{NEXTCLOUD_BASEURL}{path}"
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """Size, hit, miss and eviction counters of the forwarder's caches."""
+    return {
+        "users": user_cache.stats(),
+        "group_members": group_members_cache.stats(),
+        "listing_sizes": listing_size_cache.stats(),
+    }
+
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the client shared by all forwarder calls, opening its connection pool on first use.
+
+    Connections are kept alive between calls, so a full sync only pays for the TCP and TLS handshakes once per pooled connection. Credentials are sent as a basic auth header instead of being embedded in the URL.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        protocol = "https" if NEXTCLOUD_HTTPS else "http"
+        _client = httpx.AsyncClient(
+            base_url=f"{protocol}://{NEXTCLOUD_BASEURL}",
+            auth=(NEXTCLOUD_USERNAME, NEXTCLOUD_SECRET),
+            headers=standard_headers,
+            # JSON is much cheaper to parse than the default XML
+            params={"format": "json"},
+            limits=httpx.Limits(
+                max_connections=NEXTCLOUD_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=NEXTCLOUD_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=NEXTCLOUD_POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=NEXTCLOUD_TIMEOUT,
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client and every connection in its pool."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def page_params(limit: int | None, offset: int) -> dict[str, int]:
+    """Build the `limit` and `offset` query parameters accepted by the OCS listing endpoints, leaving out the defaults."""
+    params = {}
+    if limit is not None:
+        params["limit"] = limit
+    if offset:
+        params["offset"] = offset
+    return params
+
+
+def user_record(data: dict[str, Any], trusted: bool = False) -> NCUser:
+    """
+    Parse a user record, in either OCS format.
+
+    Unset fields are empty strings in JSON, and empty elements (`None`) in XML, where `false` is also an empty element, so a disabled user's `enabled` comes back empty.
+
+    JSON records are already typed, so with `trusted` they skip validation. XML records are all strings, and always need it.
+    """
+    data = {k: None if v == "" else v for k, v in data.items()}
+    if "enabled" in data and data["enabled"] is None:
+        data["enabled"] = False
+    if trusted:
+        return NCUser.trusted(data)
+    return NCUser.model_validate(data)
+
+
+def detail_records(container: dict | list | None) -> list[dict[str, Any]]:
+    """Flatten the records of a `/users/details` listing, which are keyed by user ID.
+
+    OCS serializes numeric keys as `<element>` tags, so users with numeric IDs come back as a list (or, for a lone user, the record itself) instead.
+    """
+    if not container:
+        return []
+    if isinstance(container, list):
+        return container
+    if "id" in container and not isinstance(container["id"], dict):
+        return [container]
+
+    records = []
+    for key, value in container.items():
+        if key == "element" and isinstance(value, list):
+            records.extend(value)
+        else:
+            records.append(value)
+    return records
+
+
+T = TypeVar("T")
+
+
+async def gather_bounded(aws: Iterable[Awaitable[T]], limit: int) -> list[T]:
+    """Await all of `aws` with at most `limit` running at once, returning their results in input order.
+
+    The first failure cancels everything still pending and is re-raised, so callers never get a partial result.
+    """
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    aws = list(aws)
+    tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        await cancel_all(tasks, aws)
+        raise
+
+
+async def iter_bounded(aws: Iterable[Awaitable[T]], limit: int) -> AsyncIterator[T]:
+    """Like `gather_bounded`, but yield each result as soon as it and every result before it are in."""
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    aws = list(aws)
+    tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # Also reached when the consumer stops early
+        await cancel_all(tasks, aws)
+
+
+async def cancel_all(tasks: list[asyncio.Future], aws: list[Awaitable]) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Coroutines whose task was cancelled before it acquired the semaphore never started
+    for aw in aws:
+        if asyncio.iscoroutine(aw):
+            aw.close()
+
+
+async def iter_pages(
+    fetch: Callable[..., Awaitable[list[T]]], **params: Any
+) -> AsyncIterator[list[T]]:
+    """
+    Read a whole Nextcloud listing, `NEXTCLOUD_PAGE_SIZE` resources per request, yielding each page as it arrives.
+
+    Only the page being consumed is held in memory, however large the directory is.
+    """
+    offset = 0
+    while True:
+        page = await fetch(limit=NEXTCLOUD_PAGE_SIZE, offset=offset, **params)
+        if page:
+            yield page
+        if len(page) < NEXTCLOUD_PAGE_SIZE:
+            return
+        offset += len(page)
+
+
+async def iter_all(
+    fetch: Callable[..., Awaitable[list[T]]], **params: Any
+) -> AsyncIterator[T]:
+    """Like `iter_pages`, yielding the resources one at a time."""
+    async for page in iter_pages(fetch, **params):
+        for resource in page:
+            yield resource
+
+
+async def fetch_all(fetch: Callable[..., Awaitable[list[T]]], **params: Any) -> list[T]:
+    """Read a whole Nextcloud listing into memory."""
+    return [resource async for resource in iter_all(fetch, **params)]
+
+
+async def count_all(fetch: Callable[..., Awaitable[list]], **params: Any) -> int:
+    """Count the resources of a whole Nextcloud listing, without holding more than a page of it."""
+    return sum([len(page) async for page in iter_pages(fetch, **params)])
+
+
+async def count_listing(key: str, fetch: Callable[..., Awaitable[list]]) -> int:
+    """Count a whole listing with `count_all`, through the cache."""
+    if (cached := listing_size_cache.get(key)) is not None:
+        return cached
+    generation = listing_size_cache.generation()
+    total = await count_all(fetch)
+    listing_size_cache.set(key, total, generation)
+    return total
 
 
 class NCStatusCode:
@@ -71,7 +352,7 @@ class NCResponse:
 
     def __init__(
         self,
-        http_response: requests.Response,
+        http_response: httpx.Response,
         status_code_mapping: NCStatusCodeMapping | list[NCStatusCode],
     ):
         http_response.raise_for_status()
@@ -79,20 +360,22 @@ class NCResponse:
         if not isinstance(status_code_mapping, NCStatusCodeMapping):
             self.status_codes_mapping = NCStatusCodeMapping(status_code_mapping)
 
-        self.raw_data = xmltodict.parse(http_response.text)["ocs"]
+        self.is_json = "json" in http_response.headers.get("content-type", "")
+        if self.is_json:
+            ocs = orjson.loads(http_response.content)["ocs"]
+            data = ocs["data"]
+        else:
+            # Servers (or proxies) that ignore `format=json` still answer in XML
+            ocs = xmltodict.parse(http_response.text)["ocs"]
+            data = NCResponse._unwrap_element_key(ocs["data"])
 
-        self.data: dict[str, Any] = NCResponse._unwrap_element_key(
-            self.raw_data["data"],
-        )
+        # Empty data is an empty list in JSON, and an empty element in XML
+        self.data: dict[str, Any] = data or {}
 
-        self.meta = self.raw_data["meta"]
+        self.meta = ocs["meta"]
         self.status = self.status_codes_mapping[int(self.meta.get("statuscode", 0))]
-        self.total_items = (
-            int(v) if (v := self.meta.get("totalitems", 0)) is not None else 0
-        )
-        self.items_per_page = (
-            int(v) if (v := self.meta.get("itemsperpage", 0)) is not None else 0
-        )
+        self.total_items = int(v) if (v := self.meta.get("totalitems")) else 0
+        self.items_per_page = int(v) if (v := self.meta.get("itemsperpage")) else 0
 
     def raise_for_status(self):
         if self.status.is_error:
@@ -121,17 +404,44 @@ class NCResponse:
 class UserAPI:
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#search-get-users
     @staticmethod
-    def get_all() -> list[str]:
+    async def get_all(limit: int | None = None, offset: int = 0) -> list[str]:
         r = NCResponse(
-            requests.get(url_assemble("/users"), headers=standard_headers),
+            await get_client().get("/users", params=page_params(limit, offset)),
             status_code_mapping=[NCStatusCode(100, 200, "Success")],
         )
         r.raise_for_status()
-        return r.data["users"]
+        return coerce_to_list(r.data["users"])
+
+    @staticmethod
+    async def count() -> int:
+        """Count all users, by walking the whole ID listing (one request per `NEXTCLOUD_PAGE_SIZE` users), through the cache."""
+        return await count_listing("users", UserAPI.get_all)
+
+    # https://docs.nextcloud.com/server/latest/developer_manual/client_apis/OCS/ocs-api-overview.html
+    @staticmethod
+    async def get_details(
+        limit: int | None = None, offset: int = 0, search: str | None = None
+    ) -> list[NCUser]:
+        """Get the full data of a page of users in a single request, instead of one request per user."""
+        params: dict[str, str | int] = {**page_params(limit, offset)}
+        if search:
+            params["search"] = search
+
+        generation = user_cache.generation()
+        r = NCResponse(
+            await get_client().get("/users/details", params=params),
+            status_code_mapping=[NCStatusCode(100, 200, "success")],
+        )
+        r.raise_for_status()
+        users = [user_record(u, r.is_json) for u in detail_records(r.data["users"])]
+        for user in users:
+            user_cache.set(user.id, UserRecord.pack(user), generation)
+        reclaim_names()
+        return users
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#add-a-new-user
     @staticmethod
-    def new(
+    async def new(
         # user_id: str,
         # display_name: str,
         # email: str,
@@ -145,8 +455,8 @@ class UserAPI:
     ):
         # fmt: off
         r = NCResponse(
-            requests.post(
-                url_assemble("/users"),
+            await get_client().post(
+                "/users",
                 headers=post_headers,
                 data={
                     "userid": nc_user.id,
@@ -175,15 +485,18 @@ class UserAPI:
         )
         # fmt: on
         r.raise_for_status()
+        directory_events.user_created(nc_user.created())
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#get-data-of-a-single-user
     @staticmethod
-    def get(user_id: str) -> NCUser:
+    async def get(user_id: str, fresh: bool = False) -> NCUser:
+        """Get a user, through the cache unless `fresh` is set, e.g. to base a write on."""
+        if not fresh and (cached := user_cache.get(user_id)) is not None:
+            return cached.unpack()
+
+        generation = user_cache.generation()
         r = NCResponse(
-            requests.get(
-                url_assemble(f"/users/{user_id}"),
-                headers=standard_headers,
-            ),
+            await get_client().get(f"/users/{user_id}"),
             status_code_mapping=[
                 NCStatusCode(100, 200, "success"),
                 NCStatusCode(404, 404, "user does not exist"),
@@ -191,11 +504,14 @@ class UserAPI:
         )
         r.raise_for_status()
 
-        return NCUser.model_validate(r.data)
+        user = user_record(r.data, r.is_json)
+        user_cache.set(user.id, UserRecord.pack(user), generation)
+        reclaim_names()
+        return user
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#edit-data-of-a-single-user
     @staticmethod
-    def update(user_id: str, key: str, value: str):
+    async def update(user_id: str, key: str, value: str):
         valid_fields = [
             "email",
             "quota",
@@ -211,9 +527,8 @@ class UserAPI:
 
         # fmt: off
         r = NCResponse(
-            requests.put(
-                url_assemble(f"/users/{user_id}"),
-                headers=standard_headers,
+            await get_client().put(
+                f"/users/{user_id}",
                 params={
                     'key': key,
                     'value': value
@@ -229,45 +544,53 @@ class UserAPI:
         )
         # fmt: on
         r.raise_for_status()
+        directory_events.user_updated(user_id, key, value)
+
+    @staticmethod
+    async def apply(user_id: str, diff: NCUserDiff):
+        """Make the changes in `diff` to the user. They're independent of each other, so they're all sent at once."""
+        calls = [
+            UserAPI.update(user_id, key, value) for key, value in diff.updates.items()
+        ]
+        if diff.enabled is not None:
+            calls.append(
+                UserAPI.enable(user_id) if diff.enabled else UserAPI.disable(user_id)
+            )
+        calls += [UserAPI.add_to_group(user_id, g) for g in diff.groups_added]
+        calls += [UserAPI.remove_from_group(user_id, g) for g in diff.groups_removed]
+        await gather_bounded(calls, NEXTCLOUD_USERS_CONCURRENCY)
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#disable-a-user
     @staticmethod
-    def disable(user_id: str):
+    async def disable(user_id: str):
         r = NCResponse(
-            requests.put(
-                url_assemble(f"/users/{user_id}/disable"),
-                headers=standard_headers,
-            ),
+            await get_client().put(f"/users/{user_id}/disable"),
             status_code_mapping=[
                 NCStatusCode(100, 200, "successful"),
                 NCStatusCode(101, 500, "failure"),
             ],
         )
         r.raise_for_status()
+        directory_events.user_enabled(user_id, False)
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#enable-a-user
     @staticmethod
-    def enable(user_id: str):
+    async def enable(user_id: str):
         r = NCResponse(
-            requests.put(
-                url_assemble(f"/users/{user_id}/enable"),
-                headers=standard_headers,
-            ),
+            await get_client().put(f"/users/{user_id}/enable"),
             status_code_mapping=[
                 NCStatusCode(100, 200, "successful"),
                 NCStatusCode(101, 500, "failure"),
             ],
         )
         r.raise_for_status()
+        directory_events.user_enabled(user_id, True)
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#delete-a-user
     @staticmethod
-    def delete(user_id: str):
+    async def delete(user_id: str):
         r = NCResponse(
-            requests.delete(
-                url_assemble(f"/users/{user_id}"),
-                headers=standard_headers,
-            ),
+            await get_client().delete(f"/users/{user_id}"),
             status_code_mapping=[
                 NCStatusCode(100, 200, "successful"),
                 NCStatusCode(101, 500, "failure"),
@@ -275,22 +598,23 @@ class UserAPI:
             ],
         )
         r.raise_for_status()
+        directory_events.user_deleted(user_id)
         # raise NotImplementedError(
         #     "Deleting users via the SCIM connector and provisioning API is currently considered unsafe and is not supported at this time."
         # )
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#get-user-s-groups
     @staticmethod
-    def get_groups(user_id: str) -> list[str]:
-        u = UserAPI.get(user_id)
+    async def get_groups(user_id: str) -> list[str]:
+        u = await UserAPI.get(user_id)
         return u.groups
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#get-user-s-groups
     @staticmethod
-    def add_to_group(user_id: str, group_id: str):
+    async def add_to_group(user_id: str, group_id: str):
         r = NCResponse(
-            requests.post(
-                url_assemble(f"/users/{user_id}/groups"),
+            await get_client().post(
+                f"/users/{user_id}/groups",
                 headers=post_headers,
                 data={"groupid": group_id},
             ),
@@ -304,13 +628,14 @@ class UserAPI:
             ],
         )
         r.raise_for_status()
+        directory_events.member_added(user_id, group_id)
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html#remove-user-from-group
     @staticmethod
-    def remove_from_group(user_id: str, group_id: str):
+    async def remove_from_group(user_id: str, group_id: str):
         r = NCResponse(
-            requests.delete(
-                url_assemble(f"/users/{user_id}/groups"),
+            await get_client().delete(
+                f"/users/{user_id}/groups",
                 headers=post_headers,
                 params={"groupid": group_id},
             ),
@@ -324,33 +649,74 @@ class UserAPI:
             ],
         )
         r.raise_for_status()
+        directory_events.member_removed(user_id, group_id)
 
 
 class GroupAPI:
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_groups.html#search-get-groups
     @staticmethod
-    def get(group_id: str | None = None) -> list[str]:
+    async def get(
+        group_id: str | None = None, limit: int | None = None, offset: int = 0
+    ) -> list[str]:
+        params: dict[str, str | int] = {**page_params(limit, offset)}
+        if group_id:
+            params["search"] = group_id
+
         r = NCResponse(
-            (
-                requests.get(url_assemble("/groups"), headers=standard_headers)
-                if not group_id
-                else requests.get(
-                    url_assemble("/groups"),
-                    headers=standard_headers,
-                    params={"search": group_id},
-                )
-            ),
+            await get_client().get("/groups", params=params),
             status_code_mapping=[NCStatusCode(100, 200, "success")],
         )
         r.raise_for_status()
-        return r.data["groups"]
+        return coerce_to_list(r.data["groups"])
+
+    @staticmethod
+    async def count() -> int:
+        """Count all groups, by walking the whole ID listing (one request per `NEXTCLOUD_PAGE_SIZE` groups), through the cache."""
+        return await count_listing("groups", GroupAPI.get)
+
+    @staticmethod
+    def iter_ids() -> AsyncIterator[str]:
+        """Iterate over the IDs of all groups, a page at a time."""
+        return iter_all(GroupAPI.get)
+
+    @staticmethod
+    async def exists(group_id: str) -> bool:
+        """
+        Whether the group exists, without listing its members.
+
+        Nextcloud's search also finds the groups whose ID merely contains the given one, so its results are looked through, a page at a time, for the exact ID.
+        """
+        if group_members_cache.get(group_id) is not None:
+            return True
+        async for gid in iter_all(GroupAPI.get, group_id=group_id):
+            if gid == group_id:
+                return True
+        return False
+
+    @staticmethod
+    async def get_details(
+        limit: int | None = None, offset: int = 0, search: str | None = None
+    ) -> list[NCGroupDetails]:
+        """Get the metadata (display name, member count, ...) of a page of groups in a single request."""
+        params: dict[str, str | int] = {**page_params(limit, offset)}
+        if search:
+            params["search"] = search
+
+        r = NCResponse(
+            await get_client().get("/groups/details", params=params),
+            status_code_mapping=[NCStatusCode(100, 200, "success")],
+        )
+        r.raise_for_status()
+        return [
+            NCGroupDetails.model_validate(g) for g in coerce_to_list(r.data["groups"])
+        ]
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_groups.html#create-a-group
     @staticmethod
-    def new(group_id: str):
+    async def new(group_id: str):
         r = NCResponse(
-            requests.post(
-                url_assemble("/groups"),
+            await get_client().post(
+                "/groups",
                 headers=post_headers,
                 data={"groupid": group_id},
             ),
@@ -362,12 +728,18 @@ class GroupAPI:
             ],
         )
         r.raise_for_status()
+        directory_events.group_created(group_id)
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_groups.html#get-members-of-a-group
     @staticmethod
-    def get_members(group_id: str) -> list[str]:
+    async def get_members(group_id: str, fresh: bool = False) -> list[str]:
+        """Get the members of a group, through the cache unless `fresh` is set, e.g. to base a write on."""
+        if not fresh and (cached := group_members_cache.get(group_id)) is not None:
+            return cached.member_ids()
+
+        generation = group_members_cache.generation()
         r = NCResponse(
-            requests.get(url_assemble(f"/groups/{group_id}"), headers=standard_headers),
+            await get_client().get(f"/groups/{group_id}"),
             status_code_mapping=[
                 NCStatusCode(100, 200, "successful"),
                 NCStatusCode(404, 404, "group does not exist"),
@@ -376,16 +748,42 @@ class GroupAPI:
         r.raise_for_status()
 
         if not r.data or not (members := r.data.get("users", [])):
-            return []
-        if isinstance(members, str):
-            return [members]
-        if isinstance(members, list):
-            return members
-        raise TypeError("Group members are not of type None, str, or list")
+            members = []
+        elif isinstance(members, str):
+            members = [members]
+        elif not isinstance(members, list):
+            raise TypeError("Group members are not of type None, str, or list")
+
+        group_members_cache.set(
+            group_id,
+            GroupRecord.pack(NCGroup(groupid=group_id, members=members)),
+            generation,
+        )
+        reclaim_names()
+        return list(members)
+
+    @staticmethod
+    def iter_members_many(group_ids: Iterable[str]) -> AsyncIterator[list[str]]:
+        """Get the members of several groups concurrently, yielding each group's members, in the order their IDs were given, as soon as they (and those of the groups before it) are in."""
+        return iter_bounded(
+            (GroupAPI.get_members(gid) for gid in group_ids),
+            NEXTCLOUD_GROUPS_CONCURRENCY,
+        )
+
+    @staticmethod
+    async def update_members(
+        group_id: str, added: Iterable[str], removed: Iterable[str]
+    ):
+        """Add and remove members of the group. Each is a separate request, so they're all sent at once."""
+        await gather_bounded(
+            [UserAPI.add_to_group(uid, group_id) for uid in added]
+            + [UserAPI.remove_from_group(uid, group_id) for uid in removed],
+            NEXTCLOUD_USERS_CONCURRENCY,
+        )
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_groups.html#edit-data-of-a-single-group
     @staticmethod
-    def update(group_id: str, key: str, value: str):
+    async def update(group_id: str, key: str, value: str):
         valid_fields = ["displayname"]
         if key not in valid_fields:
             raise ValueError(
@@ -393,9 +791,8 @@ class GroupAPI:
             )
 
         r = NCResponse(
-            requests.put(
-                url_assemble(f"/groups/{group_id}"),
-                headers=standard_headers,
+            await get_client().put(
+                f"/groups/{group_id}",
                 params={key: value},
             ),
             status_code_mapping=[
@@ -407,12 +804,9 @@ class GroupAPI:
 
     # https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_groups.html#delete-a-group
     @staticmethod
-    def delete(group_id: str):
+    async def delete(group_id: str):
         r = NCResponse(
-            requests.delete(
-                url_assemble(f"/groups/{group_id}"),
-                headers=standard_headers,
-            ),
+            await get_client().delete(f"/groups/{group_id}"),
             status_code_mapping=[
                 NCStatusCode(100, 200, "successful"),
                 NCStatusCode(101, 404, "group does not exist"),
@@ -420,9 +814,11 @@ class GroupAPI:
             ],
         )
         r.raise_for_status()
+        directory_events.group_deleted(group_id)
 
 
 if __name__ == "__main__":
+    import asyncio
     import json
 
-    print(json.dumps(GroupAPI.get()[0], indent=2))
+    print(json.dumps(asyncio.run(GroupAPI.get())[0], indent=2))
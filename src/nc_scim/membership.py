@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from nc_scim import CONNECTOR_MEMBERSHIP_INDEX, CONNECTOR_MEMBERSHIP_MAX_STALENESS
+from nc_scim.events import DirectoryListener
+from nc_scim.forwarder import GroupAPI, compact_names
+from nc_scim.models import NCUser
+from nc_scim.records import NameTable
+
+logger = logging.getLogger(__name__)
+
+# Insertion-ordered sets of interned IDs, so that members stay in the order Nextcloud lists them
+IdSet = dict[int, None]
+
+
+class MembershipIndex(DirectoryListener):
+    """
+    In-memory index of Nextcloud's group memberships, in both directions: the members of each group, and the groups of each user.
+
+    It is built by `refresh` from the group listing and one member listing per group, which for a directory with far fewer groups than users is much cheaper than reading every user. The connector's own writes are applied to it as they happen. Like the mirror, it should only be read while `is_fresh`.
+
+    IDs are interned in a table of its own, which every refresh starts afresh, so the IDs of deleted users and groups don't outlive the next one.
+    """
+
+    def __init__(self, max_staleness: float):
+        self.max_staleness = max_staleness
+        self.names = NameTable()
+        self.last_refresh: Optional[float] = None
+        self._members: dict[int, IdSet] = {}
+        self._groups: dict[int, IdSet] = {}
+        # Changes made while a refresh is running, which its listing may predate
+        self._changes_during_refresh: Optional[list[tuple[str, tuple]]] = None
+
+    def is_fresh(self) -> bool:
+        return (
+            self.last_refresh is not None
+            and time.time() - self.last_refresh <= self.max_staleness
+        )
+
+    # Reconciliation
+
+    async def refresh(self) -> None:
+        """Rebuild the index from Nextcloud, fetching the members of the groups concurrently."""
+        self._changes_during_refresh = []
+        try:
+            group_ids = [gid async for gid in GroupAPI.iter_ids()]
+            members = GroupAPI.iter_members_many(group_ids)
+            try:
+                self.apply_snapshot({gid: await anext(members) for gid in group_ids})
+            finally:
+                await members.aclose()
+            changes, self._changes_during_refresh = self._changes_during_refresh, None
+            for method, args in changes:
+                getattr(self, method)(*args)
+        finally:
+            self._changes_during_refresh = None
+        compact_names()
+
+    def apply_snapshot(self, members: dict[str, list[str]]) -> None:
+        """Replace the index with the given members of every group."""
+        names = NameTable()
+        group_members: dict[int, IdSet] = {}
+        user_groups: dict[int, IdSet] = {}
+        for group_id, user_ids in members.items():
+            gid = names.intern(group_id)
+            group_members[gid] = dict.fromkeys(names.intern_all(user_ids))
+            for uid in group_members[gid]:
+                user_groups.setdefault(uid, {})[gid] = None
+
+        self.names = names
+        self._members = group_members
+        self._groups = user_groups
+        self.last_refresh = time.time()
+        logger.info(
+            f"Membership index refreshed: {len(group_members)} groups, {len(user_groups)} users with groups"
+        )
+
+    async def run(self, interval: float) -> None:
+        """Refresh the index every `interval` seconds until cancelled."""
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Membership index refresh failed: {e}")
+            await asyncio.sleep(interval)
+
+    # Reads
+
+    def members(self, group_id: str) -> Optional[list[str]]:
+        """The members of the group, or `None` if there is no such group."""
+        if (gid := self.names.find(group_id)) is None or gid not in self._members:
+            return None
+        return self.names.names(self._members[gid])
+
+    def group_count(self) -> int:
+        return len(self._members)
+
+    def groups(self, user_id: str) -> list[str]:
+        """The groups of the user. Users the index doesn't know of are in no groups."""
+        if (uid := self.names.find(user_id)) is None:
+            return []
+        return self.names.names(self._groups.get(uid, ()))
+
+    # Directory events
+
+    def _record(self, method: str, *args) -> None:
+        if self._changes_during_refresh is not None:
+            self._changes_during_refresh.append((method, args))
+
+    def user_created(self, user: NCUser) -> None:
+        self._record("user_created", user)
+        for group_id in user.groups:
+            self._add(user.id, group_id)
+
+    def user_deleted(self, user_id: str) -> None:
+        self._record("user_deleted", user_id)
+        if (uid := self.names.find(user_id)) is None:
+            return
+        for gid in self._groups.pop(uid, ()):
+            self._members.get(gid, {}).pop(uid, None)
+
+    def member_added(self, user_id: str, group_id: str) -> None:
+        self._record("member_added", user_id, group_id)
+        self._add(user_id, group_id)
+
+    def member_removed(self, user_id: str, group_id: str) -> None:
+        self._record("member_removed", user_id, group_id)
+        uid, gid = self.names.find(user_id), self.names.find(group_id)
+        if uid is None or gid is None:
+            return
+        self._members.get(gid, {}).pop(uid, None)
+        self._groups.get(uid, {}).pop(gid, None)
+
+    def group_created(self, group_id: str) -> None:
+        self._record("group_created", group_id)
+        self._members.setdefault(self.names.intern(group_id), {})
+
+    def group_deleted(self, group_id: str) -> None:
+        self._record("group_deleted", group_id)
+        if (gid := self.names.find(group_id)) is None:
+            return
+        for uid in self._members.pop(gid, ()):
+            self._groups.get(uid, {}).pop(gid, None)
+
+    def _add(self, user_id: str, group_id: str) -> None:
+        uid, gid = self.names.intern(user_id), self.names.intern(group_id)
+        self._members.setdefault(gid, {})[uid] = None
+        self._groups.setdefault(uid, {})[gid] = None
+
+
+membership_index: Optional[MembershipIndex] = (
+    MembershipIndex(CONNECTOR_MEMBERSHIP_MAX_STALENESS)
+    if CONNECTOR_MEMBERSHIP_INDEX
+    else None
+)
+"""The connector's membership index, or `None` if `CONNECTOR_MEMBERSHIP_INDEX` isn't set."""
@@ -0,0 +1,445 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Iterable, Optional
+
+from nc_scim import CONNECTOR_MIRROR_MAX_STALENESS, CONNECTOR_MIRROR_PATH
+from nc_scim.events import DirectoryListener
+from nc_scim.forwarder import GroupAPI, UserAPI, compact_names, iter_pages
+from nc_scim.models import USER_UPDATE_FIELDS, NCGroup, NCUser
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the tables change. An outdated mirror is dropped and rebuilt by the next refresh.
+SCHEMA_VERSION = 1
+
+# The *_key columns hold the case-folded sort keys of the user's userName, displayName and email, which
+# the indexes keep in sorted order. Nulls are sorted last, as if they were greater than any value.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT,
+    displayname TEXT,
+    username_key TEXT NOT NULL,
+    email_key TEXT,
+    displayname_key TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_username_key ON users (username_key, id);
+CREATE INDEX IF NOT EXISTS users_email_key ON users (email_key IS NULL, email_key, id);
+CREATE INDEX IF NOT EXISTS users_displayname_key ON users (displayname_key IS NULL, displayname_key, id);
+
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    id_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS groups_id_key ON groups (id_key, id);
+
+CREATE TABLE IF NOT EXISTS memberships (
+    user_id TEXT NOT NULL,
+    group_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, group_id)
+);
+CREATE INDEX IF NOT EXISTS memberships_group ON memberships (group_id);
+
+CREATE TABLE IF NOT EXISTS sync (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+DROP_SCHEMA = """
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS groups;
+DROP TABLE IF EXISTS memberships;
+DROP TABLE IF EXISTS sync;
+"""
+
+# Orderings served straight from an index, by the (normalized) SCIM attribute sorted by
+USER_ORDERINGS = {
+    "username": ("username_key", "id"),
+    "id": ("id",),
+    "displayname": ("displayname_key IS NULL", "displayname_key", "id"),
+    "name.formatted": ("displayname_key IS NULL", "displayname_key", "id"),
+    "emails": ("email_key IS NULL", "email_key", "id"),
+    "emails.value": ("email_key IS NULL", "email_key", "id"),
+}
+GROUP_ORDERINGS = {
+    "displayname": ("id_key", "id"),
+    "id": ("id",),
+}
+USER_SORT_ATTRIBUTES = set(USER_ORDERINGS)
+GROUP_SORT_ATTRIBUTES = set(GROUP_ORDERINGS)
+
+INSERT_USER = """
+INSERT OR REPLACE INTO users (id, email, displayname, username_key, email_key, displayname_key, data)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def casefold(value: Optional[str]) -> Optional[str]:
+    return value.casefold() if value is not None else None
+
+
+def order_by(ordering: tuple[str, ...], descending: bool) -> str:
+    return ", ".join(f"{column} DESC" if descending else column for column in ordering)
+
+
+class DirectoryMirror(DirectoryListener):
+    """
+    Persistent SQLite replica of Nextcloud's users, groups and group memberships.
+
+    The replica is rebuilt from `UserAPI`/`GroupAPI` by `refresh`, which only rewrites the rows that changed, and the connector's own writes are applied to it in place as they happen. Reads should only be served from it while `is_fresh`; past `max_staleness` seconds since the last refresh, callers should go to Nextcloud instead.
+
+    Sort keys are case-folded in Python when a row is written, as SQLite's own case folding only covers ASCII.
+    """
+
+    def __init__(self, path: str, max_staleness: float):
+        self.path = path
+        self.max_staleness = max_staleness
+        self.last_refresh: Optional[float] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+    def open(self) -> None:
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+
+        (version,) = self._db.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            self._db.executescript(DROP_SCHEMA)
+        self._db.executescript(SCHEMA)
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        row = self._db.execute(
+            "SELECT value FROM sync WHERE key = 'last_refresh'"
+        ).fetchone()
+        self.last_refresh = row[0] if row else None
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            raise RuntimeError("The directory mirror has not been opened")
+        return self._db
+
+    def is_fresh(self) -> bool:
+        return (
+            self._db is not None
+            and self.last_refresh is not None
+            and time.time() - self.last_refresh <= self.max_staleness
+        )
+
+    # Reconciliation
+
+    async def refresh(self) -> None:
+        """
+        Reconcile the replica with Nextcloud, reading both listings page by page.
+
+        Each page is compared with the replica as it arrives, so only the rows that changed are kept around until the end.
+        """
+        snapshot = MirrorSnapshot(self)
+        async for users in iter_pages(UserAPI.get_details):
+            snapshot.add_users(users)
+        async for group_ids in iter_pages(GroupAPI.get):
+            snapshot.add_groups(group_ids)
+        self._apply(snapshot)
+        compact_names()
+
+    def apply_snapshot(self, users: Iterable[NCUser], group_ids: Iterable[str]) -> None:
+        """Make the replica match the given full listing, touching only the rows that differ."""
+        snapshot = MirrorSnapshot(self)
+        snapshot.add_users(users)
+        snapshot.add_groups(group_ids)
+        self._apply(snapshot)
+
+    def _apply(self, snapshot: MirrorSnapshot) -> None:
+        # Whatever is left of the stored users wasn't in the listing. The stored rows were read before the
+        # listing, so the connector's own writes since may already have inserted some of the listed ones.
+        stored_users = snapshot.stored_users
+        stored_groups = snapshot.stored_groups
+        stored_memberships = snapshot.stored_memberships
+        changed_users = snapshot.changed_users
+        memberships = snapshot.memberships
+        group_ids = snapshot.group_ids
+
+        with self.db:
+            self.db.executemany(INSERT_USER, changed_users)
+            self.db.executemany(
+                "DELETE FROM users WHERE id = ?", [(uid,) for uid in stored_users]
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO groups (id, id_key) VALUES (?, ?)",
+                [
+                    (gid, gid.casefold())
+                    for gid in group_ids
+                    if gid not in stored_groups
+                ],
+            )
+            self.db.executemany(
+                "DELETE FROM groups WHERE id = ?",
+                [(gid,) for gid in stored_groups.difference(group_ids)],
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO memberships (user_id, group_id) VALUES (?, ?)",
+                memberships - stored_memberships,
+            )
+            self.db.executemany(
+                "DELETE FROM memberships WHERE user_id = ? AND group_id = ?",
+                stored_memberships - memberships,
+            )
+
+            self.last_refresh = time.time()
+            self.db.execute(
+                "INSERT OR REPLACE INTO sync (key, value) VALUES ('last_refresh', ?)",
+                (self.last_refresh,),
+            )
+
+        logger.info(
+            f"Directory mirror refreshed: {len(changed_users)} users changed, {len(stored_users)} removed"
+        )
+
+    async def run(self, interval: float) -> None:
+        """Refresh the replica every `interval` seconds until cancelled."""
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Directory mirror refresh failed: {e}")
+            await asyncio.sleep(interval)
+
+    # Reads
+
+    def get_user(self, user_id: str) -> Optional[NCUser]:
+        row = self.db.execute(
+            "SELECT data FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        groups = [
+            gid
+            for (gid,) in self.db.execute(
+                "SELECT group_id FROM memberships WHERE user_id = ? ORDER BY group_id COLLATE NOCASE",
+                (user_id,),
+            )
+        ]
+        return self._user_from_row(row[0], groups)
+
+    def list_users(
+        self,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        search: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        descending: bool = False,
+    ) -> tuple[list[NCUser], int]:
+        """
+        Return one page of users, and the total number of users.
+
+        Users are ordered by the SCIM attribute `sort_by` (one of `USER_SORT_ATTRIBUTES`, userName by default) through its index, so a page costs the same however large the directory is. Like Nextcloud's user search, `search` keeps only the users whose ID, display name or email address contains it.
+        """
+        where, where_params = "", ()
+        if search:
+            where = "WHERE instr(username_key, ?) OR instr(displayname_key, ?) OR instr(email_key, ?)"
+            where_params = (search.casefold(),) * 3
+
+        ordering = order_by(USER_ORDERINGS[sort_by or "username"], descending)
+        page = (
+            f"SELECT id, data FROM users {where} ORDER BY {ordering} LIMIT ? OFFSET ?"
+        )
+        params = (*where_params, -1 if limit is None else limit, offset)
+
+        groups: dict[str, list[str]] = {}
+        for uid, gid in self.db.execute(
+            f"SELECT m.user_id, m.group_id FROM memberships m JOIN ({page}) p ON p.id = m.user_id ORDER BY m.group_id COLLATE NOCASE",
+            params,
+        ):
+            groups.setdefault(uid, []).append(gid)
+
+        users = [
+            self._user_from_row(data, groups.get(uid, []))
+            for uid, data in self.db.execute(page, params)
+        ]
+        (total,) = self.db.execute(
+            f"SELECT COUNT(*) FROM users {where}", where_params
+        ).fetchone()
+        return users, total
+
+    def get_group(self, group_id: str) -> Optional[NCGroup]:
+        if (
+            self.db.execute("SELECT 1 FROM groups WHERE id = ?", (group_id,)).fetchone()
+            is None
+        ):
+            return None
+        members = [
+            uid
+            for (uid,) in self.db.execute(
+                "SELECT user_id FROM memberships WHERE group_id = ? ORDER BY user_id COLLATE NOCASE",
+                (group_id,),
+            )
+        ]
+        return NCGroup(groupid=group_id, members=members)
+
+    def list_groups(
+        self,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        search: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        descending: bool = False,
+    ) -> tuple[list[NCGroup], int]:
+        """
+        Return one page of groups with their members, and the total number of groups.
+
+        Groups are ordered by the SCIM attribute `sort_by` (one of `GROUP_SORT_ATTRIBUTES`, displayName by default) through its index. Like Nextcloud's group search, `search` keeps only the groups whose ID contains it.
+        """
+        where, where_params = "", ()
+        if search:
+            where = "WHERE instr(id_key, ?)"
+            where_params = (search.casefold(),)
+
+        ordering = order_by(GROUP_ORDERINGS[sort_by or "displayname"], descending)
+        page = f"SELECT id FROM groups {where} ORDER BY {ordering} LIMIT ? OFFSET ?"
+        params = (*where_params, -1 if limit is None else limit, offset)
+
+        members: dict[str, list[str]] = {}
+        for gid, uid in self.db.execute(
+            f"SELECT m.group_id, m.user_id FROM memberships m JOIN ({page}) p ON p.id = m.group_id ORDER BY m.user_id COLLATE NOCASE",
+            params,
+        ):
+            members.setdefault(gid, []).append(uid)
+
+        groups = [
+            NCGroup(groupid=gid, members=members.get(gid, []))
+            for (gid,) in self.db.execute(page, params)
+        ]
+        (total,) = self.db.execute(
+            f"SELECT COUNT(*) FROM groups {where}", where_params
+        ).fetchone()
+        return groups, total
+
+    # Changes made through the connector
+
+    def user_created(self, user: NCUser) -> None:
+        with self.db:
+            self.db.execute(INSERT_USER, self._user_row(user))
+            self.db.executemany(
+                "INSERT OR IGNORE INTO memberships (user_id, group_id) VALUES (?, ?)",
+                [(user.id, gid) for gid in user.groups],
+            )
+
+    def user_updated(self, user_id: str, key: str, value: str) -> None:
+        # Anything else (e.g. the quota) isn't part of the SCIM representation and waits for the next refresh
+        if key in USER_UPDATE_FIELDS:
+            self._update_user_data(user_id, {key: value or None})
+
+    def user_enabled(self, user_id: str, enabled: bool) -> None:
+        self._update_user_data(user_id, {"enabled": enabled})
+
+    def user_deleted(self, user_id: str) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            self.db.execute("DELETE FROM memberships WHERE user_id = ?", (user_id,))
+
+    def member_added(self, user_id: str, group_id: str) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO memberships (user_id, group_id) VALUES (?, ?)",
+                (user_id, group_id),
+            )
+
+    def member_removed(self, user_id: str, group_id: str) -> None:
+        with self.db:
+            self.db.execute(
+                "DELETE FROM memberships WHERE user_id = ? AND group_id = ?",
+                (user_id, group_id),
+            )
+
+    def group_created(self, group_id: str) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO groups (id, id_key) VALUES (?, ?)",
+                (group_id, group_id.casefold()),
+            )
+
+    def group_deleted(self, group_id: str) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM groups WHERE id = ?", (group_id,))
+            self.db.execute("DELETE FROM memberships WHERE group_id = ?", (group_id,))
+
+    # Row conversion
+
+    @staticmethod
+    def _user_row(user: NCUser) -> tuple[Optional[str], ...]:
+        # Group memberships live in their own table
+        data = user.model_dump_json(exclude={"groups"})
+        return (
+            user.id,
+            user.email,
+            user.displayname,
+            user.id.casefold(),
+            casefold(user.email),
+            casefold(user.displayname),
+            data,
+        )
+
+    @staticmethod
+    def _user_from_row(data: str, groups: list[str]) -> NCUser:
+        return NCUser.trusted({**json.loads(data), "groups": groups})
+
+    def _update_user_data(self, user_id: str, changes: dict[str, Any]) -> None:
+        row = self.db.execute(
+            "SELECT data FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return
+
+        user = NCUser.model_validate({**json.loads(row[0]), **changes})
+        with self.db:
+            self.db.execute(INSERT_USER, self._user_row(user))
+
+
+class MirrorSnapshot:
+    """A full listing of Nextcloud's users and groups, compared with the rows of a `DirectoryMirror` as it is read."""
+
+    def __init__(self, mirror: DirectoryMirror):
+        db = mirror.db
+        self.stored_users: dict[str, str] = dict(
+            db.execute("SELECT id, data FROM users")
+        )
+        self.stored_groups = {gid for (gid,) in db.execute("SELECT id FROM groups")}
+        self.stored_memberships: set[tuple[str, str]] = set(
+            db.execute("SELECT user_id, group_id FROM memberships")
+        )
+
+        self.changed_users: list[tuple[Optional[str], ...]] = []
+        self.memberships: set[tuple[str, str]] = set()
+        self.group_ids: set[str] = set()
+
+    def add_users(self, users: Iterable[NCUser]) -> None:
+        for user in users:
+            row = DirectoryMirror._user_row(user)
+            if self.stored_users.pop(user.id, None) != row[-1]:
+                self.changed_users.append(row)
+            self.memberships.update((user.id, gid) for gid in user.groups)
+
+    def add_groups(self, group_ids: Iterable[str]) -> None:
+        self.group_ids.update(group_ids)
+
+
+mirror: Optional[DirectoryMirror] = (
+    DirectoryMirror(CONNECTOR_MIRROR_PATH, CONNECTOR_MIRROR_MAX_STALENESS)
+    if CONNECTOR_MIRROR_PATH
+    else None
+)
+"""The connector's directory mirror, or `None` if `CONNECTOR_MIRROR_PATH` isn't set."""
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import hashlib
+import json
+from functools import lru_cache
 from typing import Annotated, Any, Optional
 
 from pydantic import (
@@ -8,6 +11,7 @@ from pydantic import (
     ConfigDict,
     EmailStr,
     Field,
+    TypeAdapter,
     ValidationError,
 )
 from pydantic_extra_types.phone_numbers import PhoneNumber
@@ -17,6 +21,7 @@ from scim2_models import (
     Group as ScimGroup,
     GroupMember,
     GroupMembership,
+    Meta,
     Name,
     PhoneNumber as ScimPhoneNumber,
     User as ScimUser,
@@ -52,6 +57,64 @@ def coerce_to_list(elements: list | Any | None) -> list:
         return [elements]
 
 
+PHONE_NUMBER: TypeAdapter[PhoneNumber] = TypeAdapter(PhoneNumber)
+EMAIL: TypeAdapter[EmailStr] = TypeAdapter(EmailStr)
+
+
+@lru_cache(maxsize=4096)
+def format_phone(phone: str) -> str:
+    """
+    Format a phone number like validating a `PhoneNumber` does.
+
+    Parsing phone numbers is slow, so the results are cached. Numbers that don't parse are kept as they are.
+    """
+    try:
+        return PHONE_NUMBER.validate_python(phone)
+    except ValidationError:
+        return phone
+
+
+@lru_cache(maxsize=4096)
+def format_email(email: str) -> str:
+    """Normalize an email address (e.g. lowercase its domain) like validating an `EmailStr` does, so that users compare equal however they were built."""
+    try:
+        return EMAIL.validate_python(email)
+    except ValidationError:
+        return email
+
+
+def version_tag(data: dict[str, Any]) -> str:
+    """Return a weak ETag that changes whenever `data` does."""
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+    return f'W/"{hashlib.blake2b(encoded, digest_size=16).hexdigest()}"'
+
+
+USER_SCHEMAS: list[str] = ScimUser.model_fields["schemas"].default
+GROUP_SCHEMAS: list[str] = ScimGroup.model_fields["schemas"].default
+
+USER_UPDATE_FIELDS = ("email", "displayname", "phone", "address")
+"""Fields of `NCUser` that are part of its SCIM representation and can be changed with `UserAPI.update`."""
+
+
+class NCUserDiff(BaseModel):
+    """The upstream changes that turn one `NCUser` into another."""
+
+    updates: dict[str, str] = {}
+    """New values of changed `USER_UPDATE_FIELDS`, with removed values as empty strings."""
+    enabled: Optional[bool] = None
+    """Whether to enable or disable the user, if that changed."""
+    groups_added: list[str] = []
+    groups_removed: list[str] = []
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.updates
+            or self.enabled is not None
+            or self.groups_added
+            or self.groups_removed
+        )
+
+
 class NCUser(BaseModel):
     id: str = Field(alias="userid")
     """Also accepts `userid` as a valid field alias."""
@@ -71,10 +134,74 @@ class NCUser(BaseModel):
         validate_by_alias=True, validate_by_name=True, extra="allow"
     )
 
+    @classmethod
+    def trusted(cls, data: dict[str, Any]) -> NCUser:
+        """
+        Build a user from data that has already been validated, by Nextcloud or by this model, without validating it again.
+
+        Only the email address and phone number are normalized (through a cache), as they are formatted differently upstream. Anything coming from an IdP has to go through `from_scim` (and so `model_validate`) instead.
+        """
+        fields = dict(data)
+        fields["groups"] = coerce_to_list(fields.get("groups"))
+        if email := fields.get("email"):
+            fields["email"] = format_email(email)
+        if phone := fields.get("phone"):
+            fields["phone"] = format_phone(phone)
+        if isinstance(quota := fields.get("quota"), dict):
+            try:
+                fields["quota"] = Quota.model_construct(
+                    **{k: int(quota[k]) for k in Quota.model_fields}
+                )
+            except (KeyError, TypeError, ValueError):
+                # e.g. users who have never logged in have no quota details
+                fields["quota"] = None
+        return cls.model_construct(**fields)
+
+    def version(self) -> str:
+        """The user's ETag, covering everything that ends up in its SCIM representation."""
+        data = self.model_dump(
+            mode="json",
+            include={"id", "email", "displayname", "enabled", "phone", "address"},
+        )
+        data["groups"] = sorted(self.groups)
+        return version_tag(data)
+
+    def created(self) -> NCUser:
+        """The user as Nextcloud stores it after `UserAPI.new`, which only sends some fields, and enables new users."""
+        return NCUser(
+            id=self.id,
+            email=self.email,
+            displayname=self.displayname or self.id,
+            enabled=True,
+            groups=self.groups,
+            quota=self.quota,
+        )
+
+    def diff(self, target: NCUser) -> NCUserDiff:
+        """
+        Compare with the `target` state of the same user, returning only the changes needed to get there.
+
+        The target's `enabled` is left alone when it's `None`, as SCIM clients may leave `active` out.
+        """
+        updates = {}
+        for field in USER_UPDATE_FIELDS:
+            if (value := getattr(target, field)) != getattr(self, field):
+                updates[field] = str(value) if value is not None else ""
+
+        return NCUserDiff(
+            updates=updates,
+            enabled=target.enabled
+            if target.enabled is not None and target.enabled != self.enabled
+            else None,
+            groups_added=[g for g in target.groups if g not in self.groups],
+            groups_removed=[g for g in self.groups if g not in target.groups],
+        )
+
     def to_scim(self) -> ScimUser:
         scim_user = {
             "userName": self.id,
             "id": self.id,
+            "meta": Meta(resource_type="User", version=self.version()),
             "displayName": self.displayname,
             "name": Name.model_validate({"formatted": self.displayname}),
             "active": self.enabled,
@@ -108,6 +235,37 @@ class NCUser(BaseModel):
 
         return ScimUser.model_validate(scim_user)
 
+    def scim_dump(self) -> dict[str, Any]:
+        """
+        Build `self.to_scim().model_dump(scim_ctx=Context.DEFAULT)` directly, without validating and dumping the SCIM models in between.
+
+        Responses are serialized from this, so it has to be kept in sync with `to_scim`, which the tests compare it against.
+        """
+        resource: dict[str, Any] = {
+            "schemas": list(USER_SCHEMAS),
+            "id": self.id,
+            "meta": {"resourceType": "User", "version": self.version()},
+            "userName": self.id,
+            "name": {"formatted": self.displayname}
+            if self.displayname is not None
+            else {},
+        }
+        if self.displayname is not None:
+            resource["displayName"] = self.displayname
+        if self.enabled is not None:
+            resource["active"] = self.enabled
+        resource["emails"] = (
+            [{"value": str(self.email), "type": "other", "primary": True}]
+            if self.email
+            else []
+        )
+        resource["phoneNumbers"] = [{"value": str(self.phone)}] if self.phone else []
+        resource["addresses"] = [{"formatted": self.address}] if self.address else []
+        resource["groups"] = [
+            {"value": g, "display": g, "type": "direct"} for g in self.groups
+        ]
+        return resource
+
     @staticmethod
     def from_scim(scim_user: ScimUser) -> NCUser:
         # These fields are required.
@@ -146,6 +304,7 @@ class NCUser(BaseModel):
             if (scim_user.phone_numbers and len(scim_user.phone_numbers) > 0)
             else None,
             "address": address,
+            "enabled": scim_user.active,
         }
 
         return NCUser.model_validate(nc_user)
@@ -155,9 +314,14 @@ class NCGroup(BaseModel):
     groupid: str
     members: Annotated[list[str], BeforeValidator(coerce_to_list)] = []
 
+    def version(self) -> str:
+        """The group's ETag, covering its ID and members."""
+        return version_tag({"id": self.groupid, "members": sorted(self.members)})
+
     def to_scim(self) -> ScimGroup:
         data = {
             "id": self.groupid,
+            "meta": Meta(resource_type="Group", version=self.version()),
             "displayName": self.groupid,
             "members": [
                 GroupMember.model_validate({"value": gm}) for gm in self.members
@@ -166,6 +330,16 @@ class NCGroup(BaseModel):
 
         return ScimGroup.model_validate(data)
 
+    def scim_dump(self) -> dict[str, Any]:
+        """Build `self.to_scim().model_dump(scim_ctx=Context.DEFAULT)` directly, like `NCUser.scim_dump`."""
+        return {
+            "schemas": list(GROUP_SCHEMAS),
+            "id": self.groupid,
+            "meta": {"resourceType": "Group", "version": self.version()},
+            "displayName": self.groupid,
+            "members": [{"value": m} for m in self.members],
+        }
+
     @staticmethod
     def from_scim(scim_group: ScimGroup) -> NCGroup:
         group_members = (
@@ -177,6 +351,17 @@ class NCGroup(BaseModel):
         )
 
 
+class NCGroupDetails(BaseModel):
+    """Group metadata as returned by Nextcloud's `/groups/details` endpoint. Does not include the members."""
+
+    id: str
+    displayname: Optional[str] = None
+    usercount: int = 0
+    disabled: bool = False
+
+    model_config = ConfigDict(extra="allow")
+
+
 def _tc():
     d: dict[str, Any] = {
         "userid": "wow",
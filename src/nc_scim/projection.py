@@ -0,0 +1,79 @@
+"""
+SCIM attribute projection (RFC 7644, section 3.4.2.5), i.e. the `attributes` and `excludedAttributes` query parameters.
+
+A `Projection` is planned once per request. Besides trimming the serialized resources, it tells the routes which attributes they don't have to fetch from Nextcloud at all.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from nc_scim.filters import normalize_path
+
+ALWAYS_RETURNED = frozenset({"schemas", "id"})
+"""Attributes that are returned no matter what was asked for."""
+
+USER_ID_ATTRIBUTES = frozenset({"id", "username"})
+"""User attributes that are known from the user's ID alone."""
+
+
+def parse_attribute_list(
+    values: Optional[Iterable[str]],
+) -> Optional[frozenset[str]]:
+    """
+    Parse (comma-separated) attribute lists into the (normalized) top-level attributes they name.
+
+    Sub-attributes, e.g. `name.givenName`, select or exclude their whole parent attribute.
+    """
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    return frozenset(
+        normalize_path(a.strip()).split(".")[0]
+        for value in values
+        for a in value.split(",")
+        if a.strip()
+    )
+
+
+@dataclass(frozen=True)
+class Projection:
+    attributes: Optional[frozenset[str]] = None
+    """The only attributes to return, if given. Takes precedence over `excluded`."""
+    excluded: frozenset[str] = frozenset()
+
+    @classmethod
+    def parse(
+        cls,
+        attributes: Optional[Iterable[str]] = None,
+        excluded_attributes: Optional[Iterable[str]] = None,
+    ) -> Projection:
+        return cls(
+            parse_attribute_list(attributes),
+            parse_attribute_list(excluded_attributes) or frozenset(),
+        )
+
+    @property
+    def is_default(self) -> bool:
+        return self.attributes is None and not self.excluded
+
+    def includes(self, attribute: str) -> bool:
+        """Whether the (normalized, top-level) attribute is returned."""
+        if attribute in ALWAYS_RETURNED:
+            return True
+        if self.attributes is not None:
+            return attribute in self.attributes
+        return attribute not in self.excluded
+
+    def only_needs(self, attributes: Iterable[str]) -> bool:
+        """Whether everything returned is among the given (normalized, top-level) attributes, and the always returned ones."""
+        allowed = ALWAYS_RETURNED.union(attributes)
+        return self.attributes is not None and self.attributes <= allowed
+
+    def apply(self, resource: dict[str, Any]) -> dict[str, Any]:
+        """Trim a dumped SCIM resource down to the returned attributes."""
+        if self.is_default:
+            return resource
+        return {k: v for k, v in resource.items() if self.includes(k.casefold())}
@@ -1,18 +1,37 @@
+import asyncio
+import hmac
+import json
 import logging
-from typing import Annotated, Any, Mapping, Optional
+from contextlib import asynccontextmanager
+from typing import (
+    Annotated,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Mapping,
+    Optional,
+    TypeVar,
+)
 from urllib.parse import (
     parse_qs as parse_query_string,
     urlencode as encode_query_string,
 )
 
-from fastapi import Body, Depends, FastAPI, HTTPException
+import httpx
+import orjson
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.params import Query
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security.http import HTTPAuthorizationCredentials, HTTPBearer
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from scim2_models import (
     Bulk,
+    BulkOperation,
+    BulkRequest,
+    BulkResponse,
     ChangePassword,
     Context,
     Error,
@@ -22,6 +41,8 @@ from scim2_models import (
     ListResponse,
     Patch,
     PatchOp,
+    PatchOperation,
+    SearchRequest,
     ServiceProviderConfig,
     Sort,
     User as ScimUser,
@@ -30,21 +51,60 @@ from scim2_models.scim_object import ScimObject
 from starlette.background import BackgroundTask
 from starlette.types import ASGIApp, Receive, Scope, Send
 
-from nc_scim import CONNECTOR_BASEPATH, SCIM_TOKEN
-from nc_scim.forwarder import GroupAPI, UserAPI
-from nc_scim.models import NCGroup, NCUser
+from nc_scim import (
+    CONNECTOR_BASEPATH,
+    CONNECTOR_BULK_CONCURRENCY,
+    CONNECTOR_BULK_MAX_OPERATIONS,
+    CONNECTOR_BULK_MAX_PAYLOAD_SIZE,
+    CONNECTOR_MEMBERSHIP_REFRESH_INTERVAL,
+    CONNECTOR_MIRROR_REFRESH_INTERVAL,
+    CONNECTOR_SKIP_READ_AFTER_WRITE,
+    CONNECTOR_WEBHOOK_SECRET,
+    SCIM_TOKEN,
+)
+from nc_scim.bulk import error_result, run_bulk
+from nc_scim.events import directory_events
+from nc_scim.filters import (
+    GROUP_SEARCH_ATTRIBUTES,
+    USER_SEARCH_ATTRIBUTES,
+    Filter as FilterExpression,
+    FilterError,
+    normalize_path,
+    parse_filter,
+)
+from nc_scim.forwarder import (
+    GroupAPI,
+    UserAPI,
+    cache_stats,
+    close_client,
+    fetch_all,
+)
+from nc_scim.membership import MembershipIndex, membership_index
+from nc_scim.mirror import GROUP_SORT_ATTRIBUTES, USER_SORT_ATTRIBUTES, mirror
+from nc_scim.models import NCGroup, NCGroupDetails, NCUser, coerce_to_list
+from nc_scim.projection import USER_ID_ATTRIBUTES, Projection
+from nc_scim.sorting import sort_resources
+from nc_scim.webhooks import InvalidEvent, apply_event
 
 
 class QueryStringFlatteningMiddleware:
+    # Only these take comma-separated lists; a filter or sortBy may well contain a comma itself
+    LIST_PARAMETERS = {"attributes", "excludedAttributes"}
+
     def __init__(self, app: ASGIApp) -> None:
         self.app = app
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        query_string = scope.get("query_string", None).decode()
+        # Lifespan scopes carry no query string at all
+        query_string = scope.get("query_string", b"").decode()
         if scope["type"] == "http" and query_string:
             parsed = parse_query_string(query_string)
             flattened = {}
             for name, values in parsed.items():
+                if name not in self.LIST_PARAMETERS:
+                    flattened[name] = values
+                    continue
+
                 all_values = []
                 for value in values:
                     all_values.extend(value.split(","))
@@ -62,6 +122,9 @@ class QueryStringFlatteningMiddleware:
 
 
 # Helper functions
+T = TypeVar("T")
+
+
 def select_path_attr_last_parent(obj: ScimUser | ScimGroup, path_parts: list[str]):
     """
     Return the last parent in the given path.
@@ -82,6 +145,304 @@ def select_path_attr_last_parent(obj: ScimUser | ScimGroup, path_parts: list[str
     return select_path_attr_last_parent(last_parent, children)
 
 
+async def fetch_page(
+    fetch: Callable[..., Awaitable[list[T]]],
+    start_index: int,
+    count: Optional[int],
+    count_total: Callable[[], Awaitable[int]],
+) -> tuple[list[T], int]:
+    """
+    Fetch one page of resources from a Nextcloud listing, returning them and the `totalResults` to report.
+
+    SCIM's 1-based `startIndex` and `count` are passed to Nextcloud as `offset` and `limit`, so a page only costs one small upstream request. Nextcloud doesn't say how many results exist in total, so one extra resource is requested to find out whether there is a next page. The last page gives the total by itself; for any other, `count_total` has to count the whole listing, which costs a walk of it whenever its count isn't cached.
+    """
+    offset = max(start_index, 1) - 1
+    if count is None:
+        ids = await fetch(limit=None, offset=offset)
+    else:
+        ids = await fetch(limit=max(count, 0) + 1, offset=offset)
+
+    total_results = offset + len(ids)
+    if (count is not None and len(ids) > count) or (offset and not ids):
+        # There is a next page, or startIndex is past the end, so the page can't tell us the total
+        total_results = max(await count_total(), total_results)
+
+    if count is not None:
+        ids = ids[: max(count, 0)]
+    return ids, total_results
+
+
+def select_page(
+    resources: list[T],
+    dump: Callable[[T], dict[str, Any]],
+    scim_filter: Optional[FilterExpression],
+    sort_by: Optional[str],
+    descending: bool,
+    start_index: int,
+    count: Optional[int],
+) -> tuple[list[T], int]:
+    """Filter and sort resources locally by their dumped SCIM representation, returning the requested page of them and how many match in total."""
+    dumped = [(r, dump(r)) for r in resources]
+    if scim_filter is not None:
+        dumped = [(r, d) for r, d in dumped if scim_filter.matches(d)]
+    if sort_by is not None:
+        dumped = sort_resources(dumped, sort_by, descending, dump=lambda pair: pair[1])
+
+    offset = max(start_index, 1) - 1
+    end = None if count is None else offset + max(count, 0)
+    return [r for r, _ in dumped[offset:end]], len(dumped)
+
+
+def dump_scim(
+    resource: NCUser | NCGroup | ScimObject | dict[str, Any],
+) -> dict[str, Any]:
+    """Dump a resource to its SCIM representation, directly from the Nextcloud model where possible."""
+    if isinstance(resource, (NCUser, NCGroup)):
+        return resource.scim_dump()
+    if isinstance(resource, ScimObject):
+        return resource.model_dump(scim_ctx=Context.DEFAULT)
+    return resource
+
+
+def fresh_membership_index() -> Optional[MembershipIndex]:
+    """The membership index, if it is enabled and fresh."""
+    if membership_index is not None and membership_index.is_fresh():
+        return membership_index
+    return None
+
+
+async def count_groups() -> int:
+    """Count all groups, from the membership index while it is fresh, or else from Nextcloud's listing."""
+    if index := fresh_membership_index():
+        return index.group_count()
+    return await GroupAPI.count()
+
+
+async def query_users(
+    scim_filter: Optional[FilterExpression],
+    sort_by: Optional[str],
+    descending: bool,
+    start_index: int,
+    count: Optional[int],
+    projection: Projection = Projection(),
+) -> tuple[list[NCUser], int]:
+    """Return one page of (filtered, sorted) users, and how many there are in total."""
+    fresh_mirror = mirror if mirror is not None and mirror.is_fresh() else None
+    indexed = sort_by is None or sort_by in USER_SORT_ATTRIBUTES
+    index = fresh_membership_index()
+    # With the membership index, the users' groups are known without reading them either
+    id_attributes = USER_ID_ATTRIBUTES | {"groups"} if index else USER_ID_ATTRIBUTES
+
+    if scim_filter is None and (sort_by is None or (fresh_mirror and indexed)):
+        if fresh_mirror:
+            nc_users, total_results = fresh_mirror.list_users(
+                count, start_index - 1, sort_by=sort_by, descending=descending
+            )
+        elif projection.only_needs(id_attributes):
+            # The ID listing is all that's needed, which is much cheaper than the details
+            user_ids, total_results = await fetch_page(
+                UserAPI.get_all, start_index, count, UserAPI.count
+            )
+            nc_users = [
+                NCUser(id=uid, groups=index.groups(uid) if index else [])
+                for uid in user_ids
+            ]
+        else:
+            nc_users, total_results = await fetch_page(
+                UserAPI.get_details, start_index, count, UserAPI.count
+            )
+        return nc_users, total_results
+
+    # Everything that could match has to be looked at, but Nextcloud's search can narrow that down
+    search = scim_filter.search_term(USER_SEARCH_ATTRIBUTES) if scim_filter else None
+    if fresh_mirror:
+        candidates, _ = fresh_mirror.list_users(
+            search=search, sort_by=sort_by if indexed else None, descending=descending
+        )
+        if indexed:
+            sort_by = None
+    else:
+        candidates = await fetch_all(UserAPI.get_details, search=search)
+
+    return select_page(
+        candidates,
+        NCUser.scim_dump,
+        scim_filter,
+        sort_by,
+        descending,
+        start_index,
+        count,
+    )
+
+
+async def query_groups(
+    scim_filter: Optional[FilterExpression],
+    sort_by: Optional[str],
+    descending: bool,
+    start_index: int,
+    count: Optional[int],
+) -> tuple[list[NCGroup | NCGroupDetails], int]:
+    """
+    Return one page of (filtered, sorted) groups, and how many there are in total.
+
+    Groups whose members haven't been fetched yet are returned as their details, for `iter_with_members` to fill in.
+    """
+    fresh_mirror = mirror if mirror is not None and mirror.is_fresh() else None
+    indexed = sort_by is None or sort_by in GROUP_SORT_ATTRIBUTES
+
+    if scim_filter is None and (sort_by is None or (fresh_mirror and indexed)):
+        if fresh_mirror:
+            return fresh_mirror.list_groups(
+                count, start_index - 1, sort_by=sort_by, descending=descending
+            )
+        group_details, total_results = await fetch_page(
+            GroupAPI.get_details, start_index, count, count_groups
+        )
+        return group_details, total_results
+
+    dump_group = NCGroup.scim_dump
+
+    search = scim_filter.search_term(GROUP_SEARCH_ATTRIBUTES) if scim_filter else None
+    if fresh_mirror:
+        candidates, _ = fresh_mirror.list_groups(
+            search=search, sort_by=sort_by if indexed else None, descending=descending
+        )
+        return select_page(
+            candidates,
+            dump_group,
+            scim_filter,
+            None if indexed else sort_by,
+            descending,
+            start_index,
+            count,
+        )
+
+    group_details = await fetch_all(GroupAPI.get_details, search=search)
+    if scim_filter is not None and "members" in scim_filter.attributes():
+        return select_page(
+            await with_members(group_details),
+            dump_group,
+            scim_filter,
+            sort_by,
+            descending,
+            start_index,
+            count,
+        )
+
+    # Nothing looks at the members, so they're only fetched for the groups on the page
+    page, total_results = select_page(
+        group_details,
+        lambda g: dump_group(NCGroup(groupid=g.id, members=[])),
+        scim_filter,
+        sort_by,
+        descending,
+        start_index,
+        count,
+    )
+    return page, total_results
+
+
+def group_without_members(group_id: str) -> dict[str, Any]:
+    """A group whose members weren't fetched, as they aren't returned. Its version can't be known without them."""
+    return {
+        **NCGroup(groupid=group_id, members=[]).scim_dump(),
+        "meta": {"resourceType": "Group"},
+    }
+
+
+async def iter_with_members(
+    groups: list[NCGroup | NCGroupDetails],
+) -> AsyncIterator[NCGroup]:
+    """Yield the groups in order, fetching the members of those that are only details, concurrently, as they're needed."""
+    indexed: dict[str, list[str]] = {}
+    if index := fresh_membership_index():
+        for g in groups:
+            if isinstance(g, NCGroupDetails):
+                if (group_members := index.members(g.id)) is not None:
+                    indexed[g.id] = group_members
+
+    # Empty groups don't need their (empty) member list fetched, nor those in the index
+    members = GroupAPI.iter_members_many(
+        g.id
+        for g in groups
+        if isinstance(g, NCGroupDetails) and g.usercount and g.id not in indexed
+    )
+    try:
+        for g in groups:
+            if isinstance(g, NCGroup):
+                yield g
+            elif g.id in indexed:
+                yield NCGroup(groupid=g.id, members=indexed[g.id])
+            else:
+                yield NCGroup(
+                    groupid=g.id, members=await anext(members) if g.usercount else []
+                )
+    finally:
+        await members.aclose()
+
+
+async def with_members(groups: list[NCGroup | NCGroupDetails]) -> list[NCGroup]:
+    """Fetch the members of the given groups."""
+    return [g async for g in iter_with_members(groups)]
+
+
+def etag_matches(header: str, version: str) -> bool:
+    """Whether an `If-Match` or `If-None-Match` header lists `version`, or is `*`. ETags are compared weakly, ignoring any `W/` prefix."""
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or version.removeprefix("W/") in tags
+
+
+async def read_user(user_id: str) -> NCUser:
+    """Get a user from the mirror while it is fresh, or else from Nextcloud (through the cache)."""
+    if mirror is not None and mirror.is_fresh():
+        if (user := mirror.get_user(user_id)) is not None:
+            return user
+    return await UserAPI.get(user_id)
+
+
+async def read_group(group_id: str) -> NCGroup:
+    """Get a group from the mirror or the membership index while they are fresh, or else from Nextcloud (through the cache)."""
+    if mirror is not None and mirror.is_fresh():
+        if (group := mirror.get_group(group_id)) is not None:
+            return group
+    if index := fresh_membership_index():
+        if (members := index.members(group_id)) is not None:
+            return NCGroup(groupid=group_id, members=members)
+    return NCGroup(groupid=group_id, members=await GroupAPI.get_members(group_id))
+
+
+async def check_if_match(
+    if_match: Optional[str], read: Callable[[], Awaitable[NCUser | NCGroup]]
+) -> None:
+    """
+    Reject a write with 412 Precondition Failed unless the resource's current version is listed in `If-Match`.
+
+    The current version is read from the mirror or cache where possible, so a conditional write usually costs no extra request to Nextcloud.
+    """
+    if if_match is not None:
+        require_version(if_match, await read())
+
+
+def require_version(if_match: Optional[str], current: NCUser | NCGroup) -> None:
+    """Like `check_if_match`, for a resource that has already been read."""
+    if if_match is not None and not etag_matches(if_match, current.version()):
+        raise HTTPException(
+            status_code=412,
+            detail="The resource has been modified since the given version",
+        )
+
+
+async def read_current_user(user_id: str, if_match: Optional[str]) -> NCUser:
+    """
+    Read a user from Nextcloud itself to base a write on, and check it against `If-Match`.
+
+    The mirror and the cache may not have caught up with changes made in Nextcloud directly, and a diff against them would skip writes that are still needed. They are only used for the version check.
+    """
+    current = await UserAPI.get(user_id, fresh=True)
+    await check_if_match(if_match, lambda: read_user(user_id))
+    return current
+
+
 class UnauthorizedMessage(Error):
     detail: str = "Bearer token missing or unknown."
     status: int = 401
@@ -101,6 +462,21 @@ class ScimInternalServerError(Error):
         super().__init__(detail=f"Internal server error: '{exc}'")
 
 
+class ScimUpstreamError(Error):
+    status: int = 502
+
+    def __init__(self, exc: httpx.HTTPError):
+        super().__init__(detail=f"Request to Nextcloud failed: '{exc}'")
+
+
+class ScimInvalidFilter(Error):
+    status: int = 400
+    scim_type: str = "invalidFilter"
+
+    def __init__(self, exc: FilterError):
+        super().__init__(detail=str(exc))
+
+
 class ScimHttpException(Error):
     def __init__(self, exc: HTTPException):
         super().__init__(status=exc.status_code, detail=exc.detail)
@@ -128,15 +504,22 @@ class ScimJsonResponse(JSONResponse):
 
     def __init__(
         self,
-        content: ScimObject | BaseModel | dict[str, Any],
+        content: NCUser | NCGroup | ScimObject | BaseModel | dict[str, Any],
         status_code: int = 200,
         headers: Mapping[str, str] | None = None,
         background: BackgroundTask | None = None,
+        projection: Optional[Projection] = None,
     ):
-        if isinstance(content, ScimObject):
+        if isinstance(content, (NCUser, NCGroup)):
+            content = content.scim_dump()
+            # A single resource's version doubles as the response's ETag
+            headers = {"ETag": content["meta"]["version"], **(headers or {})}
+        elif isinstance(content, ScimObject):
+            if (meta := getattr(content, "meta", None)) and meta.version:
+                headers = {"ETag": meta.version, **(headers or {})}
             content = content.model_dump(scim_ctx=Context.DEFAULT)
-        elif isinstance(content, (NCUser, NCGroup)):
-            content = content.to_scim().model_dump(scim_ctx=Context.DEFAULT)
+        if projection is not None and isinstance(content, dict):
+            content = projection.apply(content)
 
         super().__init__(
             content=content,
@@ -145,11 +528,86 @@ class ScimJsonResponse(JSONResponse):
             background=background,
         )
 
+    def render(self, content: Any) -> bytes:
+        return render_json(content)
+
 
 class ScimContentlessResponse(Response):
     media_type = "application/scim+json"
 
 
+def render_json(content: Any) -> bytes:
+    """Encode JSON with orjson, which gives the same bytes as `JSONResponse.render`, only much faster."""
+    return orjson.dumps(content)
+
+
+ListedResource = NCUser | NCGroup | ScimObject | dict[str, Any]
+
+
+class ScimListResponse(StreamingResponse):
+    """
+    A `ListResponse`, written out one resource at a time.
+
+    The body is the same as `ScimJsonResponse` would send for the whole `ListResponse`, but only one resource is held in its dumped form at a time. As the status is sent first, the resources must already have been read from Nextcloud, so that an upstream failure is still answered with a proper SCIM error instead of a truncated list; only their serialization is streamed.
+    """
+
+    media_type = "application/scim+json"
+
+    def __init__(
+        self,
+        resource_type: type[ScimUser] | type[ScimGroup],
+        resources: Iterable[ListedResource],
+        total_results: int,
+        start_index: int,
+        items_per_page: int,
+        projection: Projection = Projection(),
+        status_code: int = 200,
+    ):
+        envelope = ListResponse[resource_type].model_validate(
+            {
+                "totalResults": total_results,
+                "itemsPerPage": items_per_page,
+                "startIndex": start_index,
+                "Resources": [],
+            }
+        )
+        super().__init__(
+            self.render_body(
+                envelope.model_dump(scim_ctx=Context.DEFAULT), resources, projection
+            ),
+            status_code=status_code,
+        )
+
+    @staticmethod
+    async def render_body(
+        envelope: dict[str, Any],
+        resources: Iterable[ListedResource],
+        projection: Projection,
+    ) -> AsyncIterator[bytes]:
+        # `Resources` is the envelope's last member, so the resources go right before its closing `]}`
+        head = render_json(envelope)
+        yield head[: -len(b"]}")]
+
+        separator = b""
+        for resource in resources:
+            yield separator + render_json(projection.apply(dump_scim(resource)))
+            separator = b","
+        yield b"]}"
+
+
+def write_response(resource: NCUser | NCGroup, projection: Projection) -> Response:
+    """
+    Answer a PATCH with the resource as it is after the write, limited to the requested attributes.
+
+    When responses are built without reading back from Nextcloud and no attributes are requested, there's no body at all, as RFC 7644 (section 3.5.2) allows.
+    """
+    if CONNECTOR_SKIP_READ_AFTER_WRITE and projection.is_default:
+        return ScimContentlessResponse(
+            status_code=204, headers={"ETag": resource.version()}
+        )
+    return ScimJsonResponse(status_code=200, content=resource, projection=projection)
+
+
 # Configure basic logging
 
 logging.basicConfig(
@@ -161,7 +619,44 @@ logging.basicConfig(
 # Create a logger instance
 logger = logging.getLogger(__name__)
 
-app = FastAPI(separate_input_output_schemas=False, root_path=str(CONNECTOR_BASEPATH))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    refresh_task = None
+    if mirror is not None:
+        mirror.open()
+        directory_events.register(mirror)
+        refresh_task = asyncio.create_task(
+            mirror.run(CONNECTOR_MIRROR_REFRESH_INTERVAL)
+        )
+    index_task = None
+    if membership_index is not None:
+        directory_events.register(membership_index)
+        index_task = asyncio.create_task(
+            membership_index.run(CONNECTOR_MEMBERSHIP_REFRESH_INTERVAL)
+        )
+
+    yield
+
+    if mirror is not None:
+        refresh_task.cancel()
+        await asyncio.gather(refresh_task, return_exceptions=True)
+        directory_events.unregister(mirror)
+        mirror.close()
+    if membership_index is not None:
+        index_task.cancel()
+        await asyncio.gather(index_task, return_exceptions=True)
+        directory_events.unregister(membership_index)
+    logger.info(f"Cache statistics: {cache_stats()}")
+    # Drop the pooled Nextcloud connections on shutdown
+    await close_client()
+
+
+app = FastAPI(
+    separate_input_output_schemas=False,
+    root_path=str(CONNECTOR_BASEPATH),
+    lifespan=lifespan,
+)
 app.add_middleware(QueryStringFlatteningMiddleware)
 
 
@@ -169,6 +664,8 @@ COMMON_API_RESPONSES: dict[int | str, dict[str, Any]] = {
     401: {"model": UnauthorizedMessage},
     422: {"model": ScimValidationError},
     500: {"model": ScimInternalServerError},
+    400: {"model": ScimInvalidFilter},
+    502: {"model": ScimUpstreamError},
 }
 COMMON_API_DEPENDENCIES = [Depends(get_token)]
 
@@ -187,6 +684,18 @@ async def internal_server_error_handler(request: ..., exc: Exception):
     return ScimJsonResponse(status_code=500, content=ScimInternalServerError(exc))
 
 
+@app.exception_handler(httpx.HTTPError)
+async def upstream_error_handler(request: ..., exc: httpx.HTTPError):
+    logger.error(str(exc))
+    return ScimJsonResponse(status_code=502, content=ScimUpstreamError(exc))
+
+
+@app.exception_handler(FilterError)
+async def invalid_filter_handler(request: ..., exc: FilterError):
+    logger.error(str(exc))
+    return ScimJsonResponse(status_code=400, content=ScimInvalidFilter(exc))
+
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: ..., exc: HTTPException):
     logger.error(str(exc))
@@ -203,34 +712,34 @@ async def http_exception_handler(request: ..., exc: HTTPException):
     dependencies=COMMON_API_DEPENDENCIES,
     responses=COMMON_API_RESPONSES,
 )
-def get_users(
-    attributes: Annotated[list, Query()] = [],
+async def get_users(
+    attributes: Annotated[Optional[list[str]], Query()] = None,
     count: Optional[int] = None,
-    excludedAttributes: Annotated[list, Query()] = [],
-    # filter: Optional[str] = None,  # TODO: need to work on this one
-    # sortBy: str = 'id',
-    # sortOrder: Optional[SearchRequest.SortOrder] = None,
+    excludedAttributes: Annotated[Optional[list[str]], Query()] = None,
+    filter: Optional[str] = None,
+    sortBy: Optional[str] = None,
+    sortOrder: Optional[SearchRequest.SortOrder] = None,
     startIndex: int = 1,
     # token: str = Depends(get_token),
 ) -> ScimJsonResponse:
-    # Get all users
-    all_users = UserAPI.get_all()
-
-    # Set dynamic defaults of parameters
-    if not count:
-        count = len(all_users)
-
-    scim_users: list[ScimUser] = []
-    for u in all_users[startIndex - 1 : count]:
-        u_data = UserAPI.get(u)
-        scim_users.append(u_data.to_scim())
-
-    out_data = ListResponse[ScimUser].model_validate(
-        {"Resources": [u.model_dump() for u in scim_users]}
+    startIndex = max(startIndex, 1)
+    projection = Projection.parse(attributes, excludedAttributes)
+    nc_users, total_results = await query_users(
+        parse_filter(filter) if filter is not None else None,
+        normalize_path(sortBy) if sortBy else None,
+        sortOrder == SearchRequest.SortOrder.descending,
+        startIndex,
+        count,
+        projection,
     )
-    return ScimJsonResponse(
-        status_code=200,
-        content=out_data,
+
+    return ScimListResponse(
+        ScimUser,
+        nc_users,
+        total_results=total_results,
+        start_index=startIndex,
+        items_per_page=len(nc_users),
+        projection=projection,
     )
 
 
@@ -241,16 +750,24 @@ def get_users(
     dependencies=COMMON_API_DEPENDENCIES,
     responses=COMMON_API_RESPONSES,
 )
-def get_user_by_id(
+async def get_user_by_id(
     user_id: str,
-    attributes: Annotated[list, Query()] = [],
-    excludedAttributes: Annotated[list, Query()] = [],
+    attributes: Annotated[Optional[list[str]], Query()] = None,
+    excludedAttributes: Annotated[Optional[list[str]], Query()] = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
     token: str = Depends(get_token),
 ):
     """Get the user with the specified user ID."""
-    user = UserAPI.get(user_id)
+    user = await read_user(user_id)
+
+    # The client's copy is current, so there's no need to build the SCIM representation at all
+    version = user.version()
+    if if_none_match is not None and etag_matches(if_none_match, version):
+        return Response(status_code=304, headers={"ETag": version})
 
-    return ScimJsonResponse(user)
+    return ScimJsonResponse(
+        user, projection=Projection.parse(attributes, excludedAttributes)
+    )
 
 
 @app.post(
@@ -261,14 +778,17 @@ def get_user_by_id(
     responses=COMMON_API_RESPONSES,
     status_code=201,
 )
-def create_user(
+async def create_user(
     data: ScimUser = Body(media_type="application/scim+json"),
     token: str = Depends(get_token),
 ):
     nc_user = NCUser.from_scim(data)
-    UserAPI.new(nc_user)
+    await UserAPI.new(nc_user)
 
-    new = UserAPI.get(nc_user.id)
+    if CONNECTOR_SKIP_READ_AFTER_WRITE:
+        new = nc_user.created()
+    else:
+        new = await UserAPI.get(nc_user.id)
 
     return ScimJsonResponse(status_code=201, content=new)
 
@@ -280,27 +800,96 @@ def create_user(
     responses=COMMON_API_RESPONSES,
     response_class=ScimContentlessResponse,
 )
-def delete_user(
+async def delete_user(
     user_id: str,
+    if_match: Annotated[Optional[str], Header()] = None,
     token: str = Depends(get_token),
 ):
-    UserAPI.delete(user_id)
+    await check_if_match(if_match, lambda: read_user(user_id))
+    await UserAPI.delete(user_id)
     return ScimContentlessResponse(status_code=204)
 
 
-# @app.patch(
-#     "/Users/{user_id}",
-#     dependencies=COMMON_API_DEPENDENCIES,
-#     responses=COMMON_API_RESPONSES,
-#     response_class=ScimJsonResponse,
+@app.patch(
+    "/Users/{user_id}",
+    response_model=ScimUser,
+    response_class=ScimJsonResponse,
+    dependencies=COMMON_API_DEPENDENCIES,
+    responses=COMMON_API_RESPONSES,
+)
+async def update_user(
+    user_id: str,
+    data: PatchOp[ScimUser] = Body(media_type="application/scim+json"),
+    attributes: Annotated[Optional[list[str]], Query()] = None,
+    excludedAttributes: Annotated[Optional[list[str]], Query()] = None,
+    if_match: Annotated[Optional[str], Header()] = None,
+    token: str = Depends(get_token),
+):
+    """
+    Apply the patch to the user's current state, then send only what actually changed to Nextcloud.
+
+    Each changed field is its own OCS call, and they're sent concurrently, so e.g. deactivating a user costs a single upstream write, and a patch that changes nothing costs none.
+    """
+    if not data.operations:
+        raise HTTPException(status_code=400, detail="No operations given")
+
+    current = await read_current_user(user_id, if_match)
+
+    scim_user = current.to_scim()
+    try:
+        data.patch(scim_user)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    target = NCUser.from_scim(scim_user)
+    return write_response(
+        await write_user(current, target),
+        Projection.parse(attributes, excludedAttributes),
+    )
+
+
+@app.put(
+    "/Users/{user_id}",
+    response_model=ScimUser,
+    response_class=ScimJsonResponse,
+    dependencies=COMMON_API_DEPENDENCIES,
+    responses=COMMON_API_RESPONSES,
+)
+async def replace_user(
+    user_id: str,
+    data: ScimUser = Body(media_type="application/scim+json"),
+    if_match: Annotated[Optional[str], Header()] = None,
+    token: str = Depends(get_token),
+):
+    """
+    Replace the user, sending only what differs from its current state to Nextcloud.
+
+    IdPs tend to PUT every user on every sync, so an unchanged user costs no upstream writes. `groups` is read-only and `active` optional, so they are left alone when not given.
+    """
+    current = await read_current_user(user_id, if_match)
+
+    if data.user_name is None:
+        data = data.model_copy(update={"user_name": user_id})
+    target = NCUser.from_scim(data)
+    if data.groups is None:
+        target.groups = current.groups
+    return ScimJsonResponse(status_code=200, content=await write_user(current, target))
+
+
+async def write_user(current: NCUser, target: NCUser) -> NCUser:
+    """Make the changes between the user's `current` and `target` state, and return the user as it is now."""
+    if target.id != current.id:
+        raise HTTPException(status_code=400, detail="userName cannot be changed")
 
-# )
-# def update_user_not_implemented(user_id: str, data: PatchOp[ScimUser]):
-#     # return ScimJsonResponse(
-#     #     status_code=405,
-#     #     content="PATCH operations on users are currently not implemented. See README.md for details.",
-#     # )
-#     return HTTPException(status_code=405)
+    if diff := current.diff(target):
+        await UserAPI.apply(current.id, diff)
+
+    if CONNECTOR_SKIP_READ_AFTER_WRITE:
+        update = {"quota": current.quota}
+        if target.enabled is None:
+            update["enabled"] = current.enabled
+        return target.model_copy(update=update)
+    return await read_user(current.id)
 
 
 # Groups
@@ -313,35 +902,42 @@ def delete_user(
     dependencies=COMMON_API_DEPENDENCIES,
     responses=COMMON_API_RESPONSES,
 )
-def get_groups(
-    # attributes: Annotated[list, Query()] = [],
+async def get_groups(
+    attributes: Annotated[Optional[list[str]], Query()] = None,
     count: Optional[int] = None,
-    # excludedAttributes: Annotated[list, Query()] = [],
-    # filter: Optional[str] = None,  # TODO: need to work on this one
-    # sortBy: str = 'id',
-    # sortOrder: Optional[SearchRequest.SortOrder] = None,
+    excludedAttributes: Annotated[Optional[list[str]], Query()] = None,
+    filter: Optional[str] = None,
+    sortBy: Optional[str] = None,
+    sortOrder: Optional[SearchRequest.SortOrder] = None,
     startIndex: int = 1,
     token: str = Depends(get_token),
 ):
-    # Get all groups
-    all_group_ids = GroupAPI.get()
-
-    # Set dynamic defaults of parameters
-    if not count:
-        count = len(all_group_ids)
-
-    nc_groups: list[NCGroup] = [
-        NCGroup.model_validate({"groupid": gid, "members": GroupAPI.get_members(gid)})
-        for gid in all_group_ids[startIndex - 1 : count]
-    ]
-
-    scim_groups: list[ScimGroup] = [ncg.to_scim() for ncg in nc_groups]
+    startIndex = max(startIndex, 1)
+    projection = Projection.parse(attributes, excludedAttributes)
+    nc_groups, total_results = await query_groups(
+        parse_filter(filter) if filter is not None else None,
+        normalize_path(sortBy) if sortBy else None,
+        sortOrder == SearchRequest.SortOrder.descending,
+        startIndex,
+        count,
+    )
 
-    return ScimJsonResponse(
-        # status_code=200,
-        content=ListResponse[ScimGroup].model_validate(
-            {"Resources": [g.model_dump() for g in scim_groups]}
+    if projection.includes("members"):
+        # Every member list is in before the response starts, so a failure can still be reported
+        scim_groups = await with_members(nc_groups)
+    else:
+        scim_groups = (
+            g if isinstance(g, NCGroup) else group_without_members(g.id)
+            for g in nc_groups
         )
+
+    return ScimListResponse(
+        ScimGroup,
+        scim_groups,
+        total_results=total_results,
+        start_index=startIndex,
+        items_per_page=len(nc_groups),
+        projection=projection,
     )
 
 
@@ -352,20 +948,34 @@ def get_groups(
     dependencies=COMMON_API_DEPENDENCIES,
     responses=COMMON_API_RESPONSES,
 )
-def get_group_by_id(
+async def get_group_by_id(
     group_id: str,
-    # attributes: Annotated[list, Query()] = ["members"],
-    # excludedAttributes: Annotated[list, Query()] = [],
+    attributes: Annotated[Optional[list[str]], Query()] = None,
+    excludedAttributes: Annotated[Optional[list[str]], Query()] = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
     token: str = Depends(get_token),
 ):
-    nc_group = NCGroup.model_validate(
-        {
-            "groupid": group_id,
-            "members": GroupAPI.get_members(group_id),
-        }
-    )
+    projection = Projection.parse(attributes, excludedAttributes)
+    if (
+        not projection.includes("members")
+        and if_none_match is None
+        and (mirror is None or not mirror.is_fresh())
+        and fresh_membership_index() is None
+    ):
+        # The group only has to exist, as neither its members nor its version (which depends on them) are needed
+        if not await GroupAPI.exists(group_id):
+            raise HTTPException(status_code=404, detail="group does not exist")
+        return ScimJsonResponse(
+            content=group_without_members(group_id), projection=projection
+        )
 
-    return ScimJsonResponse(content=nc_group)
+    nc_group = await read_group(group_id)
+
+    version = nc_group.version()
+    if if_none_match is not None and etag_matches(if_none_match, version):
+        return Response(status_code=304, headers={"ETag": version})
+
+    return ScimJsonResponse(content=nc_group, projection=projection)
 
 
 @app.post(
@@ -376,7 +986,7 @@ def get_group_by_id(
     responses=COMMON_API_RESPONSES,
     status_code=201,
 )
-def create_group(
+async def create_group(
     data: ScimGroup = Body(media_type="application/scim+json"),
     token: str = Depends(get_token),
 ):
@@ -386,16 +996,13 @@ def create_group(
             detail="The `displayName` field is required for group creation",
         )
 
-    GroupAPI.new(data.display_name)
-    members = GroupAPI.get_members(data.display_name)
+    await GroupAPI.new(data.display_name)
+    if CONNECTOR_SKIP_READ_AFTER_WRITE:
+        members = []
+    else:
+        members = await GroupAPI.get_members(data.display_name)
 
-    group = ScimGroup.model_validate(
-        {
-            "displayName": data.display_name,
-            "id": data.display_name,
-            "members": members,
-        }
-    )
+    group = NCGroup(groupid=data.display_name, members=members)
     return ScimJsonResponse(status_code=201, content=group)
 
 
@@ -406,11 +1013,13 @@ def create_group(
     dependencies=COMMON_API_DEPENDENCIES,
     responses=COMMON_API_RESPONSES,
 )
-def delete_group(
+async def delete_group(
     group_id: str,
+    if_match: Annotated[Optional[str], Header()] = None,
     token: str = Depends(get_token),
 ):
-    GroupAPI.delete(group_id)
+    await check_if_match(if_match, lambda: read_group(group_id))
+    await GroupAPI.delete(group_id)
     return ScimContentlessResponse(status_code=204)
 
 
@@ -421,20 +1030,74 @@ def delete_group(
     responses=COMMON_API_RESPONSES,
     response_model=ScimGroup,
 )
-def update_group_membership(
+async def update_group_membership(
     group_id: str,
     data: PatchOp[ScimGroup] = Body(media_type="application/scim+json"),
+    attributes: Annotated[Optional[list[str]], Query()] = None,
+    excludedAttributes: Annotated[Optional[list[str]], Query()] = None,
+    if_match: Annotated[Optional[str], Header()] = None,
     token: str = Depends(get_token),
 ):
+    """
+    Apply the operations to the group's current members, then add and remove only the users whose membership actually changed.
+
+    The operations are coalesced first, so e.g. adding and then removing a user who isn't a member costs nothing upstream, and a `replace` with the full member list only changes the difference.
+    """
     if not data.operations:
         raise HTTPException(status_code=400, detail="No operations given")
 
-    for op in data.operations:
-        if not op.value:
+    # The changes are based on Nextcloud's own members, which the mirror or index may not have caught up with
+    current = NCGroup(
+        groupid=group_id, members=await GroupAPI.get_members(group_id, fresh=True)
+    )
+    await check_if_match(if_match, lambda: read_group(group_id))
+
+    members = patch_members(current.members, data.operations)
+    added = [uid for uid in members if uid not in current.members]
+    removed = [uid for uid in current.members if uid not in members]
+    if added or removed:
+        await GroupAPI.update_members(group_id, added, removed)
+
+    # Member lists can be huge, so they're only read back if they're going to be returned
+    projection = Projection.parse(attributes, excludedAttributes)
+    if not CONNECTOR_SKIP_READ_AFTER_WRITE and projection.includes("members"):
+        members = await GroupAPI.get_members(group_id)
+
+    return write_response(NCGroup(groupid=group_id, members=members), projection)
+
+
+def patch_members(members: list[str], operations: list[PatchOperation]) -> list[str]:
+    """Apply the operations of a group PATCH to a list of member IDs, in order."""
+    members = list(members)
+
+    def value_ids(value: Any) -> list[str]:
+        if not value:
             raise HTTPException(status_code=400, detail="No users given")
-        user_ids = [u["value"] for u in op.value]
+        return [u["value"] for u in coerce_to_list(value)]
+
+    for op in operations:
+        path, value = op.path, op.value
+        if path is None and op.op == "replace" and isinstance(value, dict):
+            # Path-less replaces give the new values of whole attributes
+            if value.keys() - {"members"}:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Only patching group membership is implemented at this time",
+                )
+            path, value = "members", value["members"]
+
+        if path is not None and path.casefold().startswith("members["):
+            # e.g. `members[value eq "alice"]`, which selects the members to remove
+            if op.op != "remove" or not path.endswith("]"):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unsupported path '{path}' for operation '{op.op}'",
+                )
+            selected = parse_filter(path[len("members[") : -1])
+            members = [m for m in members if not selected.matches({"value": m})]
+            continue
 
-        if op.path != "members":
+        if path is None or path.casefold() != "members":
             raise HTTPException(
                 status_code=400,
                 detail="Only patching group membership is implemented at this time",
@@ -442,22 +1105,175 @@ def update_group_membership(
 
         match op.op:
             case "add":
-                for uid in user_ids:
-                    UserAPI.add_to_group(uid, group_id)
+                members += [
+                    uid for uid in dict.fromkeys(value_ids(value)) if uid not in members
+                ]
 
             case "remove":
-                for uid in user_ids:
-                    UserAPI.remove_from_group(uid, group_id)
+                # Removing the attribute itself removes all members
+                remove = value_ids(value) if value is not None else members
+                members = [m for m in members if m not in remove]
+
+            case "replace":
+                members = list(dict.fromkeys(value_ids(value) if value else []))
 
             case _:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Unimplemented operation '{data.operations[0].op}'",
+                    detail=f"Unimplemented operation '{op.op}'",
                 )
 
-    group = NCGroup(groupid=group_id, members=GroupAPI.get_members(group_id))
+    return members
+
+
+# Bulk
+
+
+async def execute_bulk_operation(
+    request: Request, operation: BulkOperation, token: str
+) -> tuple[BulkOperation, Optional[str]]:
+    """Run one bulk operation through the matching route, returning its result and the ID of the resource it created."""
+    resource_type, _, resource_id = (operation.path or "").strip("/").partition("/")
+    description = f"{getattr(operation.method, 'value', None)} {operation.path}"
+    try:
+        match (operation.method, resource_type, resource_id or None):
+            case (BulkOperation.Method.post, "Users", None):
+                response = await create_user(
+                    ScimUser.model_validate(operation.data), token=token
+                )
+            case (BulkOperation.Method.post, "Groups", None):
+                response = await create_group(
+                    ScimGroup.model_validate(operation.data), token=token
+                )
+            case (BulkOperation.Method.delete, "Users", str()):
+                response = await delete_user(
+                    resource_id, if_match=operation.version, token=token
+                )
+            case (BulkOperation.Method.delete, "Groups", str()):
+                response = await delete_group(
+                    resource_id, if_match=operation.version, token=token
+                )
+            case (BulkOperation.Method.put, "Users", str()):
+                response = await replace_user(
+                    resource_id,
+                    ScimUser.model_validate(operation.data),
+                    if_match=operation.version,
+                    token=token,
+                )
+            case (BulkOperation.Method.patch, "Users", str()):
+                response = await update_user(
+                    resource_id,
+                    PatchOp[ScimUser].model_validate(operation.data),
+                    if_match=operation.version,
+                    token=token,
+                )
+            case (BulkOperation.Method.patch, "Groups", str()):
+                response = await update_group_membership(
+                    resource_id,
+                    PatchOp[ScimGroup].model_validate(operation.data),
+                    if_match=operation.version,
+                    token=token,
+                )
+            case _:
+                raise HTTPException(
+                    status_code=405,
+                    detail=f"{description} is not supported in bulk requests",
+                )
+    except ValidationError as e:
+        error = Error(status=400, scim_type="invalidSyntax", detail=str(e))
+    except HTTPException as e:
+        error = ScimHttpException(e)
+    except httpx.HTTPError as e:
+        error = ScimUpstreamError(e)
+    except Exception as e:
+        error = ScimInternalServerError(e)
+    else:
+        body = json.loads(response.body) if response.body else {}
+        if response.status_code >= 400:
+            error = Error.model_validate(body)
+        else:
+            resource_id = body.get("id", resource_id)
+            location = request.url_for(
+                "get_user_by_id" if resource_type == "Users" else "get_group_by_id",
+                **{"user_id" if resource_type == "Users" else "group_id": resource_id},
+            )
+            result = BulkOperation(
+                method=operation.method,
+                bulk_id=operation.bulk_id,
+                version=response.headers.get("ETag"),
+                location=str(location),
+                status=response.status_code,
+            )
+            return (
+                result,
+                resource_id if operation.method == BulkOperation.Method.post else None,
+            )
+
+    logger.error(f"Bulk operation {description} failed: {error.detail}")
+    return error_result(operation, error.status, error.detail), None
+
+
+@app.post(
+    "/Bulk",
+    response_model=BulkResponse,
+    response_class=ScimJsonResponse,
+    dependencies=COMMON_API_DEPENDENCIES,
+    responses={**COMMON_API_RESPONSES, 413: {"model": ScimHttpException}},
+)
+async def bulk(request: Request, token: str = Depends(get_token)):
+    body = await request.body()
+    if len(body) > CONNECTOR_BULK_MAX_PAYLOAD_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"The size of the bulk operation exceeds the maxPayloadSize ({CONNECTOR_BULK_MAX_PAYLOAD_SIZE})",
+        )
+    try:
+        bulk_request = BulkRequest.model_validate_json(body)
+    except ValidationError as e:
+        return ScimJsonResponse(
+            status_code=400,
+            content=Error(status=400, scim_type="invalidSyntax", detail=str(e)),
+        )
+
+    operations = bulk_request.operations or []
+    if len(operations) > CONNECTOR_BULK_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"The number of operations exceeds the maxOperations ({CONNECTOR_BULK_MAX_OPERATIONS})",
+        )
+
+    results = await run_bulk(
+        operations,
+        lambda op: execute_bulk_operation(request, op, token),
+        bulk_request.fail_on_errors,
+        CONNECTOR_BULK_CONCURRENCY,
+    )
+    return ScimJsonResponse(content=BulkResponse(operations=results))
+
+
+# Webhooks
+
+
+@app.post("/Webhooks/Nextcloud", status_code=204, include_in_schema=False)
+async def nextcloud_webhook(
+    payload: Annotated[dict[str, Any], Body()],
+    auth: Optional[HTTPAuthorizationCredentials] = Depends(get_bearer_token),
+):
+    """Apply a user or group change event sent by Nextcloud's `webhook_listeners` app."""
+    if not CONNECTOR_WEBHOOK_SECRET:
+        raise HTTPException(status_code=404, detail="Webhooks are not enabled")
+    if auth is None or not hmac.compare_digest(
+        auth.credentials.encode(), CONNECTOR_WEBHOOK_SECRET.encode()
+    ):
+        raise HTTPException(status_code=401, detail="Webhook secret missing or unknown")
 
-    return ScimJsonResponse(status_code=200, content=group)
+    try:
+        applied = await apply_event(payload)
+    except InvalidEvent as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not applied:
+        logger.debug(f"Ignored Nextcloud event {payload['event'].get('class')}")
+    return Response(status_code=204)
 
 
 # Service Provider Config
@@ -470,16 +1286,20 @@ def update_group_membership(
     responses=COMMON_API_RESPONSES,
     response_model=ServiceProviderConfig,
 )
-def get_service_provider_config(
+async def get_service_provider_config(
     token: str = Depends(get_token),
 ):
     spc = ServiceProviderConfig(
-        sort=Sort(supported=False),
-        etag=ETag(supported=False),
-        bulk=Bulk(supported=False),
+        sort=Sort(supported=True),
+        etag=ETag(supported=True),
+        bulk=Bulk(
+            supported=True,
+            max_operations=CONNECTOR_BULK_MAX_OPERATIONS,
+            max_payload_size=CONNECTOR_BULK_MAX_PAYLOAD_SIZE,
+        ),
         change_password=ChangePassword(supported=False),
         patch=Patch(supported=True),
-        filter=Filter(supported=False),
+        filter=Filter(supported=True),
     )
     return ScimJsonResponse(status_code=200, content=spc)
 
@@ -0,0 +1,178 @@
+"""
+Compact in-memory representations of users and groups, for caching large parts of the directory.
+
+A full `NCUser` carries a pydantic model, a dict of extra fields, a nested `Quota` model and a list of group names, which adds up to a few KB per user. The records here keep the same data in slots: user and group IDs are interned in a `NameTable` and memberships are stored as arrays of their integer IDs, extra fields are kept serialized, and the quota as a plain tuple. Converting a model to a record and back is lossless.
+"""
+
+from __future__ import annotations
+
+from array import array
+from typing import Iterable, Optional
+
+import orjson
+
+from nc_scim.models import NCGroup, NCUser, Quota
+
+QUOTA_FIELDS = tuple(Quota.model_fields)
+
+
+class NameTable:
+    """
+    Interns user and group IDs as small integers, so that each name is stored once however many memberships reference it.
+
+    Every ID seen stays in the table until `compact` drops those that nothing references any more, e.g. those of deleted users and groups.
+    """
+
+    __slots__ = ("_ids", "_names")
+
+    def __init__(self) -> None:
+        self._ids: dict[str, int] = {}
+        self._names: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def intern(self, name: str) -> int:
+        """Return the integer ID of `name`, assigning one if it hasn't been seen before."""
+        if (i := self._ids.get(name)) is None:
+            i = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return i
+
+    def intern_all(self, names: Iterable[str]) -> array[int]:
+        return array("I", [self.intern(n) for n in names])
+
+    def find(self, name: str) -> Optional[int]:
+        """Return the integer ID of `name`, or `None` if it hasn't been seen, without assigning one."""
+        return self._ids.get(name)
+
+    def name(self, i: int) -> str:
+        return self._names[i]
+
+    def names(self, ids: Iterable[int]) -> list[str]:
+        return [self._names[i] for i in ids]
+
+    def compact(self, in_use: Iterable[int]) -> dict[int, int]:
+        """
+        Drop every name but those with the given integer IDs, which are renumbered.
+
+        Returns the new ID of each kept name by its old one, which everything still holding IDs from the table must be remapped with.
+        """
+        kept = sorted(set(in_use))
+        self._names = [self._names[i] for i in kept]
+        self._ids = {name: i for i, name in enumerate(self._names)}
+        return {old: new for new, old in enumerate(kept)}
+
+
+NAMES = NameTable()
+"""The table shared by the records of the connector's caches."""
+
+
+class UserRecord:
+    """A user, as stored in memory. Groups are kept in their original order, and extra fields as JSON."""
+
+    __slots__ = (
+        "id",
+        "email",
+        "displayname",
+        "enabled",
+        "groups",
+        "quota",
+        "phone",
+        "address",
+        "extra",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        email: Optional[str],
+        displayname: Optional[str],
+        enabled: Optional[bool],
+        groups: array[int],
+        quota: Optional[tuple[int, ...]],
+        phone: Optional[str],
+        address: Optional[str],
+        extra: Optional[bytes],
+    ):
+        self.id = id
+        self.email = email
+        self.displayname = displayname
+        self.enabled = enabled
+        self.groups = groups
+        self.quota = quota
+        self.phone = phone
+        self.address = address
+        self.extra = extra
+
+    @classmethod
+    def pack(cls, user: NCUser, names: NameTable = NAMES) -> UserRecord:
+        return cls(
+            id=user.id,
+            email=user.email,
+            displayname=user.displayname,
+            enabled=user.enabled,
+            groups=names.intern_all(user.groups),
+            quota=(
+                tuple(getattr(user.quota, f) for f in QUOTA_FIELDS)
+                if user.quota is not None
+                else None
+            ),
+            phone=user.phone,
+            address=user.address,
+            extra=orjson.dumps(user.model_extra) if user.model_extra else None,
+        )
+
+    def unpack(self, names: NameTable = NAMES) -> NCUser:
+        """Rebuild the user. The record's data has been validated as an `NCUser` before, so it isn't validated again."""
+        return NCUser.model_construct(
+            **(orjson.loads(self.extra) if self.extra is not None else {}),
+            id=self.id,
+            email=self.email,
+            displayname=self.displayname,
+            enabled=self.enabled,
+            groups=names.names(self.groups),
+            quota=(
+                Quota.model_construct(**dict(zip(QUOTA_FIELDS, self.quota)))
+                if self.quota is not None
+                else None
+            ),
+            phone=self.phone,
+            address=self.address,
+        )
+
+    def in_group(self, group_id: str, names: NameTable = NAMES) -> bool:
+        return (i := names.find(group_id)) is not None and i in self.groups
+
+    def remap(self, ids: dict[int, int]) -> None:
+        """Renumber the groups after `NameTable.compact`."""
+        self.groups = array("I", [ids[i] for i in self.groups])
+
+
+class GroupRecord:
+    """A group and its members, as stored in memory. Members are kept in their original order."""
+
+    __slots__ = ("groupid", "members")
+
+    def __init__(self, groupid: str, members: array[int]):
+        self.groupid = groupid
+        self.members = members
+
+    @classmethod
+    def pack(cls, group: NCGroup, names: NameTable = NAMES) -> GroupRecord:
+        return cls(group.groupid, names.intern_all(group.members))
+
+    def unpack(self, names: NameTable = NAMES) -> NCGroup:
+        return NCGroup.model_construct(
+            groupid=self.groupid, members=self.member_ids(names)
+        )
+
+    def member_ids(self, names: NameTable = NAMES) -> list[str]:
+        return names.names(self.members)
+
+    def has_member(self, user_id: str, names: NameTable = NAMES) -> bool:
+        return (i := names.find(user_id)) is not None and i in self.members
+
+    def remap(self, ids: dict[int, int]) -> None:
+        """Renumber the members after `NameTable.compact`."""
+        self.members = array("I", [ids[i] for i in self.members])
@@ -0,0 +1,56 @@
+"""
+SCIM sorting (RFC 7644, section 3.4.2.3) of resources that aren't already ordered by an index of the mirror.
+
+The ordering matches the mirror's: case-insensitive for everything but `id`, missing values last when ascending (first when descending), and ties broken by `id`.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Optional, TypeVar
+
+from nc_scim.filters import CASE_EXACT_ATTRIBUTES
+
+T = TypeVar("T")
+
+
+def pick_primary(values: list[Any]) -> Any:
+    """Multi-valued attributes are sorted by their primary value, or else their first one."""
+    for value in values:
+        if isinstance(value, dict) and value.get("primary"):
+            return value
+    return values[0] if values else None
+
+
+def sort_value(resource: dict[str, Any], path: str) -> Any:
+    """Return the value that `resource` is sorted by for the (normalized) attribute `path`."""
+    value: Any = resource
+    for name in path.split("."):
+        if isinstance(value, list):
+            value = pick_primary(value)
+        if not isinstance(value, dict):
+            return None
+        value = next((v for k, v in value.items() if k.casefold() == name), None)
+
+    if isinstance(value, list):
+        value = pick_primary(value)
+    if isinstance(value, dict):
+        value = next((v for k, v in value.items() if k.casefold() == "value"), None)
+    if isinstance(value, str) and path not in CASE_EXACT_ATTRIBUTES:
+        value = value.casefold()
+    return value
+
+
+def sort_resources(
+    resources: list[T],
+    path: str,
+    descending: bool,
+    dump: Callable[[T], dict[str, Any]],
+) -> list[T]:
+    """Sort resources by the (normalized) attribute `path` of their dumped SCIM representation."""
+
+    def key(resource: T) -> tuple[bool, Any, Optional[str]]:
+        dumped = dump(resource)
+        value = sort_value(dumped, path)
+        return (value is None, value if value is not None else "", dumped.get("id"))
+
+    return sorted(resources, key=key, reverse=descending)
@@ -0,0 +1,99 @@
+"""
+Nextcloud change events, as POSTed by its `webhook_listeners` app, applied to the connector's state.
+
+Events are turned into the same `directory_events` calls the connector's own writes make, so the caches, the mirror and the membership index all stay current with changes made in Nextcloud itself, without waiting for them to expire or be refreshed. The connector's own writes come back as events too, which is harmless, as applying a change twice leaves the same state.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from nc_scim.events import directory_events
+from nc_scim.forwarder import NCAPIException, UserAPI
+
+# UserChangedEvent features, by the user field they change
+USER_FEATURES = {
+    "displayName": "displayname",
+    "eMailAddress": "email",
+    "phone": "phone",
+    "address": "address",
+}
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def event_name(event: dict[str, Any]) -> str:
+    """The event's class name, without its namespace, e.g. `UserCreatedEvent`."""
+    return str(event.get("class", "")).rsplit("\\", 1)[-1]
+
+
+def entity_id(event: dict[str, Any], entity: str, id_key: str) -> str:
+    """
+    Find the ID of the event's user or group.
+
+    Nextcloud serializes them as objects (`{"user": {"uid": ...}}`), but some events only carry the ID (`{"uid": ...}`), so both are accepted.
+    """
+    value = event.get(entity)
+    if isinstance(value, dict):
+        value = value.get(id_key, value.get("id"))
+    elif value is None:
+        value = event.get(id_key)
+    if not isinstance(value, str) or not value:
+        raise InvalidEvent(f"{event_name(event)} has no {entity} ID")
+    return value
+
+
+def is_enabled(value: Any) -> bool:
+    return value in (True, 1, "1", "true")
+
+
+async def apply_event(payload: dict[str, Any]) -> bool:
+    """Apply a webhook payload's event. Returns whether it was one the connector keeps track of."""
+    event = payload.get("event")
+    if not isinstance(event, dict):
+        raise InvalidEvent("The payload has no event")
+
+    match event_name(event):
+        case "UserCreatedEvent":
+            # The event only names the user, so the rest has to be read
+            user_id = entity_id(event, "user", "uid")
+            try:
+                user = await UserAPI.get(user_id)
+            except NCAPIException as e:
+                # OCS reports a missing user in its own status code, with HTTP 200
+                if e.status_code != 404:
+                    raise
+                # Deleted again before the event got here
+                return True
+            directory_events.user_created(user)
+        case "UserChangedEvent":
+            user_id = entity_id(event, "user", "uid")
+            feature: Optional[str] = event.get("feature")
+            value = event.get("value")
+            if feature == "enabled":
+                directory_events.user_enabled(user_id, is_enabled(value))
+            else:
+                # Other features aren't part of the SCIM representation, but still make the cached user stale
+                key = USER_FEATURES.get(feature or "", feature or "")
+                directory_events.user_updated(
+                    user_id, key, value if isinstance(value, str) else ""
+                )
+        case "UserDeletedEvent":
+            directory_events.user_deleted(entity_id(event, "user", "uid"))
+        case "UserAddedEvent":
+            directory_events.member_added(
+                entity_id(event, "user", "uid"), entity_id(event, "group", "gid")
+            )
+        case "UserRemovedEvent":
+            directory_events.member_removed(
+                entity_id(event, "user", "uid"), entity_id(event, "group", "gid")
+            )
+        case "GroupCreatedEvent":
+            directory_events.group_created(entity_id(event, "group", "gid"))
+        case "GroupDeletedEvent":
+            directory_events.group_deleted(entity_id(event, "group", "gid"))
+        case _:
+            return False
+    return True
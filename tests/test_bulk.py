@@ -0,0 +1,72 @@
+import asyncio
+
+from scim2_models import BulkOperation
+
+from nc_scim.bulk import bulk_references, resolve_references, run_bulk
+
+POST = BulkOperation.Method.post
+PATCH = BulkOperation.Method.patch
+
+
+def test_references():
+    data = {"members": [{"value": "bulkId:u1"}, {"value": "bob"}], "x": "bulkId:u2"}
+    assert bulk_references(["/Groups/bulkId:g1", data]) == {"g1", "u1", "u2"}
+    assert resolve_references(data, {"u1": "alice", "u2": "carol"}) == {
+        "members": [{"value": "alice"}, {"value": "bob"}],
+        "x": "carol",
+    }
+
+
+def run(operations, fail_on_errors=None, fail=()):
+    executed = []
+
+    async def execute(op):
+        executed.append(op.path)
+        await asyncio.sleep(0)
+        status = 400 if op.path in fail else 201
+        created = op.bulk_id.upper() if op.bulk_id and status < 400 else None
+        return BulkOperation(
+            method=op.method, bulk_id=op.bulk_id, status=status
+        ), created
+
+    results = asyncio.run(run_bulk(operations, execute, fail_on_errors, 4))
+    return results, executed
+
+
+def test_dependencies_run_first():
+    results, executed = run(
+        [
+            BulkOperation(method=PATCH, path="/Groups/bulkId:g", data="bulkId:u"),
+            BulkOperation(method=POST, path="/Users", bulk_id="u"),
+            BulkOperation(method=POST, path="/Groups", bulk_id="g"),
+        ]
+    )
+    assert executed.index("/Groups/G") > max(
+        executed.index("/Users"), executed.index("/Groups")
+    )
+    assert [r.status for r in results] == [201, 201, 201]
+    assert [r.bulk_id for r in results] == [None, "u", "g"]
+
+
+def test_failed_and_circular_references():
+    results, executed = run(
+        [
+            BulkOperation(method=POST, path="/Users", bulk_id="u"),
+            BulkOperation(method=PATCH, path="/Groups/x", data="bulkId:u"),
+            BulkOperation(method=PATCH, path="/Groups/a", bulk_id="a", data="bulkId:b"),
+            BulkOperation(method=PATCH, path="/Groups/b", bulk_id="b", data="bulkId:a"),
+        ],
+        fail={"/Users"},
+    )
+    assert executed == ["/Users"]
+    assert [r.status for r in results] == [400, 409, 409, 409]
+
+
+def test_fail_on_errors_stops_processing():
+    operations = [
+        BulkOperation(method=POST, path="/Users", bulk_id=str(i)) for i in range(5)
+    ]
+    results, executed = run(operations, fail_on_errors=1, fail={"/Users"})
+    # Operations on the same path run in order, so the first failure stops the rest
+    assert executed == ["/Users"]
+    assert [r.status for r in results] == [400]
@@ -0,0 +1,87 @@
+import pytest
+
+from nc_scim import cache
+from nc_scim.cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_and_miss(clock):
+    c: TTLCache[str, int] = TTLCache(ttl=10, max_entries=10)
+    assert c.get("a") is None
+    c.set("a", 1)
+    assert c.get("a") == 1
+    assert c.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_entries_expire(clock):
+    c: TTLCache[str, int] = TTLCache(ttl=10, max_entries=10)
+    c.set("a", 1)
+    clock[0] += 9.9
+    assert c.get("a") == 1
+    clock[0] += 0.1
+    assert c.get("a") is None
+    assert len(c) == 0
+
+
+def test_least_recently_used_is_evicted(clock):
+    c: TTLCache[str, int] = TTLCache(ttl=10, max_entries=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    assert c.evictions == 1
+
+
+def test_invalidation(clock):
+    c: TTLCache[str, list[str]] = TTLCache(ttl=10, max_entries=10)
+    c.set("admin", ["admin"])
+    c.set("names", ["alice", "bob"])
+    c.set("haters", ["john"])
+    c.invalidate("admin", "missing")
+    c.invalidate_where(lambda _, members: "bob" in members)
+    assert c.get("admin") is None
+    assert c.get("names") is None
+    assert c.get("haters") == ["john"]
+
+
+def test_disabled(clock):
+    c: TTLCache[str, int] = TTLCache(ttl=0, max_entries=10)
+    c.set("a", 1)
+    assert not c.enabled
+    assert c.get("a") is None
+
+
+def test_values_fetched_before_an_invalidation_are_dropped(clock):
+    c: TTLCache[str, int] = TTLCache(ttl=10, max_entries=10)
+    generation = c.generation()
+    c.invalidate("a")
+    c.set("a", 1, generation)
+    c.set("b", 2, generation)
+    assert (c.get("a"), c.get("b")) == (None, 2)
+
+    # Fetched after the invalidation
+    c.set("a", 3, c.generation())
+    assert c.get("a") == 3
+
+    generation = c.generation()
+    c.invalidate_where(lambda key, _: key == "nothing")
+    c.set("c", 4, generation)
+    assert c.get("c") is None
+
+
+def test_forgotten_invalidations_still_drop_older_values(clock):
+    c: TTLCache[str, int] = TTLCache(ttl=10, max_entries=2)
+    generation = c.generation()
+    c.invalidate("a")
+    c.invalidate("b", "c")
+    c.set("a", 1, generation)
+    assert c.get("a") is None
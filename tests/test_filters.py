@@ -0,0 +1,97 @@
+import pytest
+
+from nc_scim.filters import (
+    USER_SEARCH_ATTRIBUTES,
+    And,
+    Comparison,
+    FilterError,
+    Not,
+    Or,
+    Present,
+    ValuePath,
+    parse_filter,
+)
+
+USER = {
+    "id": "jdoe",
+    "userName": "JDoe",
+    "displayName": "Jane Doe",
+    "active": True,
+    "emails": [
+        {"value": "jane@example.com", "type": "work", "primary": True},
+        {"value": "jane@home.example", "type": "home"},
+    ],
+    "groups": [{"value": "staff"}],
+}
+
+
+def test_parse():
+    assert parse_filter(
+        'userName eq "bjensen" and (emails[type eq "work"] or not (title pr))'
+    ) == And(
+        Comparison("username", "eq", "bjensen"),
+        Or(
+            ValuePath("emails", Comparison("type", "eq", "work")),
+            Not(Present("title")),
+        ),
+    )
+    assert parse_filter(
+        'urn:ietf:params:scim:schemas:core:2.0:User:userName EQ "a\\"b"'
+    ) == Comparison("username", "eq", 'a"b')
+    assert parse_filter("active eq true or x gt 5") == Or(
+        Comparison("active", "eq", True), Comparison("x", "gt", 5)
+    )
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "",
+        "userName",
+        'userName eq "a" and',
+        'userName xx "a"',
+        "(userName pr",
+        "a eq b",
+        'userName eq "a\\x"',
+    ],
+)
+def test_parse_invalid(expression):
+    with pytest.raises(FilterError):
+        parse_filter(expression)
+
+
+@pytest.mark.parametrize(
+    ("expression", "matches"),
+    [
+        ('userName eq "jdoe"', True),
+        ('id eq "JDOE"', False),
+        ('displayName co "ne d"', True),
+        ('emails.value ew "@home.example"', True),
+        ('emails eq "jane@example.com"', True),
+        ('emails[type eq "home" and value sw "jane@example"]', False),
+        ('emails[type eq "work" and primary eq true]', True),
+        ("active eq false", False),
+        ('userName ne "jdoe"', False),
+        ("title pr", False),
+        ("title eq null", True),
+        ('not (groups.value eq "staff")', False),
+    ],
+)
+def test_matches(expression, matches):
+    assert parse_filter(expression).matches(USER) == matches
+
+
+@pytest.mark.parametrize(
+    ("expression", "term"),
+    [
+        ('userName eq "jdoe"', "jdoe"),
+        ('active eq true and emails[value co "example"]', "example"),
+        ('userName ew "doe"', None),
+        ('userName eq "a" or userName eq "b"', None),
+        ('userName sw "a" or emails.value sw "a"', "a"),
+        ('not (userName eq "jdoe")', None),
+        ('nickName eq "jdoe"', None),
+    ],
+)
+def test_search_term(expression, term):
+    assert parse_filter(expression).search_term(USER_SEARCH_ATTRIBUTES) == term
@@ -0,0 +1,165 @@
+import asyncio
+
+import httpx
+
+from nc_scim import forwarder
+from nc_scim.cache import TTLCache
+from nc_scim.forwarder import (
+    GroupAPI,
+    NCResponse,
+    NCStatusCode,
+    count_all,
+    detail_records,
+    iter_pages,
+    user_record,
+)
+from nc_scim.models import NCGroup, NCUser
+from nc_scim.records import GroupRecord, NameTable, UserRecord
+
+OK = [NCStatusCode(100, 200, "success")]
+REQUEST = httpx.Request("GET", "https://cloud.example.com/ocs/v1.php/cloud/users")
+
+XML = """<?xml version="1.0"?>
+<ocs>
+ <meta><status>ok</status><statuscode>100</statuscode><message>OK</message><totalitems></totalitems><itemsperpage></itemsperpage></meta>
+ <data><users><alice><id>alice</id><enabled></enabled><email>alice@example.com</email><phone></phone><groups><element>names</element></groups></alice></users></data>
+</ocs>
+"""
+
+JSON = {
+    "ocs": {
+        "meta": {
+            "status": "ok",
+            "statuscode": 100,
+            "message": "OK",
+            "totalitems": "",
+            "itemsperpage": "",
+        },
+        "data": {
+            "users": {
+                "alice": {
+                    "id": "alice",
+                    "enabled": False,
+                    "email": "alice@example.com",
+                    "phone": "",
+                    "groups": ["names"],
+                }
+            }
+        },
+    }
+}
+
+
+def test_formats_are_parsed_alike():
+    from_xml = NCResponse(
+        httpx.Response(
+            200, text=XML, headers={"content-type": "text/xml"}, request=REQUEST
+        ),
+        OK,
+    )
+    from_json = NCResponse(httpx.Response(200, json=JSON, request=REQUEST), OK)
+
+    for r in (from_xml, from_json):
+        assert (r.status.nc, r.total_items, r.items_per_page) == (100, 0, 0)
+        [user] = [user_record(u) for u in detail_records(r.data["users"])]
+        assert (user.id, user.enabled, user.phone, user.groups) == (
+            "alice",
+            False,
+            None,
+            ["names"],
+        )
+
+
+def test_empty_data():
+    empty = {"ocs": {"meta": {"statuscode": 100}, "data": []}}
+    assert NCResponse(httpx.Response(200, json=empty, request=REQUEST), OK).data == {}
+
+
+def test_listings_are_read_page_by_page(monkeypatch):
+    monkeypatch.setattr(forwarder, "NEXTCLOUD_PAGE_SIZE", 2)
+    requests = []
+
+    async def fetch(limit: int, offset: int) -> list[int]:
+        requests.append((limit, offset))
+        return list(range(5))[offset : offset + limit]
+
+    async def pages() -> list[list[int]]:
+        return [page async for page in iter_pages(fetch)]
+
+    assert asyncio.run(pages()) == [[0, 1], [2, 3], [4]]
+    assert requests == [(2, 0), (2, 2), (2, 4)]
+    assert asyncio.run(count_all(fetch)) == 5
+
+
+def test_group_exists_by_exact_id(monkeypatch):
+    monkeypatch.setattr(forwarder, "NEXTCLOUD_PAGE_SIZE", 2)
+    monkeypatch.setattr(forwarder, "group_members_cache", TTLCache(30, 100))
+    groups = ["staff-a", "staff-b", "staff-c", "staff"]
+
+    async def get(group_id: str, limit: int, offset: int) -> list[str]:
+        return [g for g in groups if group_id in g][offset : offset + limit]
+
+    monkeypatch.setattr(GroupAPI, "get", get)
+    # The exact match is past the first page of search results
+    assert asyncio.run(GroupAPI.exists("staff"))
+    assert not asyncio.run(GroupAPI.exists("staf"))
+
+
+def test_names_of_uncached_records_are_reclaimed(monkeypatch):
+    names = NameTable()
+    monkeypatch.setattr(forwarder, "NAMES", names)
+    monkeypatch.setattr(forwarder, "user_cache", TTLCache(30, 100))
+    monkeypatch.setattr(forwarder, "group_members_cache", TTLCache(30, 100))
+
+    for group_id, members in {"names": ["bob", "alice"], "admin": ["carol"]}.items():
+        group = NCGroup(groupid=group_id, members=members)
+        forwarder.group_members_cache.set(group_id, GroupRecord.pack(group, names))
+    user = NCUser.model_validate({"id": "dave", "groups": ["admin"]})
+    forwarder.user_cache.set("dave", UserRecord.pack(user, names))
+    # e.g. carol was deleted
+    forwarder.group_members_cache.invalidate("admin")
+
+    forwarder.compact_names()
+    assert sorted(names.names(range(len(names)))) == ["admin", "alice", "bob"]
+    assert forwarder.group_members_cache.get("names").member_ids(names) == [
+        "bob",
+        "alice",
+    ]
+    assert forwarder.user_cache.get("dave").unpack(names) == user
+
+
+def ocs(data) -> dict:
+    return {"ocs": {"meta": {"status": "ok", "statuscode": 100}, "data": data}}
+
+
+def test_invalidation_during_fetch_is_not_cached(monkeypatch):
+    monkeypatch.setattr(forwarder, "user_cache", TTLCache(30, 100))
+    upstream = {"displayname": "old"}
+
+    async def run() -> str:
+        fetching, release = asyncio.Event(), asyncio.Event()
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.method == "PUT":
+                upstream["displayname"] = request.url.params["value"]
+                return httpx.Response(200, json=ocs([]))
+            user = {"id": "a", "enabled": True, "groups": [], **upstream}
+            fetching.set()
+            await release.wait()
+            return httpx.Response(200, json=ocs(user))
+
+        monkeypatch.setattr(
+            forwarder,
+            "_client",
+            httpx.AsyncClient(
+                transport=httpx.MockTransport(handler), base_url="https://nc"
+            ),
+        )
+        stale = asyncio.create_task(forwarder.UserAPI.get("a"))
+        await fetching.wait()
+        await forwarder.UserAPI.update("a", "displayname", "new")
+        release.set()
+        assert (await stale).displayname == "old"
+        return (await forwarder.UserAPI.get("a")).displayname
+
+    assert asyncio.run(run()) == "new"
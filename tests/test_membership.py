@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from nc_scim.forwarder import GroupAPI
+from nc_scim.membership import MembershipIndex
+from nc_scim.models import NCUser
+
+
+@pytest.fixture
+def index():
+    i = MembershipIndex(max_staleness=60)
+    i.apply_snapshot({"names": ["bob", "alice"], "admin": ["bob"], "empty": []})
+    return i
+
+
+def test_snapshot_is_indexed_both_ways(index):
+    assert index.is_fresh()
+    assert index.members("names") == ["bob", "alice"]
+    assert index.members("empty") == []
+    assert index.members("nope") is None
+    assert index.groups("bob") == ["names", "admin"]
+    assert index.groups("carol") == []
+    assert index.group_count() == 3
+
+
+def test_writes_are_applied_in_place(index):
+    index.user_created(NCUser.model_validate({"id": "carol", "groups": ["empty"]}))
+    index.member_added("alice", "admin")
+    index.member_removed("bob", "names")
+    index.group_created("new")
+    index.group_deleted("empty")
+    index.user_deleted("alice")
+
+    assert index.members("admin") == ["bob"]
+    assert index.members("names") == []
+    assert index.members("new") == []
+    assert index.members("empty") is None
+    assert index.groups("carol") == []
+    assert index.groups("bob") == ["admin"]
+    assert index.group_count() == 3
+
+
+def test_refresh_reclaims_deleted_ids(index):
+    index.user_deleted("alice")
+    index.group_deleted("empty")
+    index.apply_snapshot({"names": ["bob"], "admin": ["bob"]})
+    assert len(index.names) == 3
+    assert index.groups("bob") == ["names", "admin"]
+
+
+def test_freshness(index):
+    index.last_refresh -= 61
+    assert not index.is_fresh()
+
+
+def test_writes_during_refresh_are_replayed(index, monkeypatch):
+    async def iter_ids():
+        for group_id in ("names", "admin"):
+            yield group_id
+
+    async def get_members(group_id: str) -> list[str]:
+        if group_id == "names":
+            # The connector writes while the listings are being read, which they predate
+            index.member_added("carol", "names")
+            index.member_removed("bob", "admin")
+            await asyncio.sleep(0)
+        return {"names": ["bob", "alice"], "admin": ["bob"]}[group_id]
+
+    monkeypatch.setattr(GroupAPI, "iter_ids", iter_ids)
+    monkeypatch.setattr(GroupAPI, "get_members", get_members)
+    asyncio.run(index.refresh())
+
+    assert index.members("names") == ["bob", "alice", "carol"]
+    assert index.members("admin") == []
+    assert index.members("empty") is None
+    assert index.groups("bob") == ["names"]
+    assert index.groups("carol") == ["names"]
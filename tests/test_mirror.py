@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from nc_scim.forwarder import GroupAPI, UserAPI
+from nc_scim.mirror import DirectoryMirror
+from nc_scim.models import NCUser
+
+
+def user(uid: str, groups: list[str], **fields) -> NCUser:
+    return NCUser.model_validate({"id": uid, "groups": groups, **fields})
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    m = DirectoryMirror(str(tmp_path / "mirror.db"), max_staleness=60)
+    m.open()
+    m.apply_snapshot(
+        [
+            user("bob", ["admin", "names"], displayname="Bob"),
+            user("Alice", ["names"], email="alice@example.com"),
+            user("carol", []),
+        ],
+        ["names", "admin", "empty"],
+    )
+    yield m
+    m.close()
+
+
+def test_snapshot_is_listed_in_order(mirror):
+    users, total = mirror.list_users()
+    assert total == 3
+    assert [u.id for u in users] == ["Alice", "bob", "carol"]
+    assert users[0].email == "alice@example.com"
+    assert users[1].groups == ["admin", "names"]
+
+    groups, total = mirror.list_groups(limit=2, offset=1)
+    assert total == 3
+    assert [(g.groupid, g.members) for g in groups] == [
+        ("empty", []),
+        ("names", ["Alice", "bob"]),
+    ]
+
+
+def test_sorted_listing(mirror):
+    users, _ = mirror.list_users(sort_by="displayname")
+    assert [u.id for u in users] == ["bob", "Alice", "carol"]
+    users, _ = mirror.list_users(limit=2, sort_by="emails.value", descending=True)
+    assert [u.id for u in users] == ["carol", "bob"]
+    users, _ = mirror.list_users(sort_by="id")
+    assert [u.id for u in users] == ["Alice", "bob", "carol"]
+
+    # Sort keys follow writes
+    mirror.user_updated("carol", "displayname", "Aaron")
+    users, _ = mirror.list_users(limit=1, sort_by="displayname")
+    assert [u.id for u in users] == ["carol"]
+
+    groups, _ = mirror.list_groups(descending=True)
+    assert [g.groupid for g in groups] == ["names", "empty", "admin"]
+
+
+def test_outdated_schema_is_rebuilt(mirror):
+    mirror.db.execute("PRAGMA user_version = 0")
+    mirror.close()
+    mirror.open()
+    assert mirror.list_users() == ([], 0)
+    assert not mirror.is_fresh()
+
+
+def test_snapshot_only_applies_differences(mirror):
+    mirror.apply_snapshot(
+        [user("bob", ["names"], displayname="Robert"), user("dave", ["admin"])],
+        ["names", "admin"],
+    )
+
+    assert mirror.get_user("Alice") is None
+    assert mirror.get_user("bob").displayname == "Robert"
+    assert mirror.get_group("empty") is None
+    assert mirror.get_group("admin").members == ["dave"]
+    assert mirror.get_group("names").members == ["bob"]
+
+
+def test_writes_are_applied_in_place(mirror):
+    mirror.user_created(user("dave", ["names"]))
+    mirror.user_updated("dave", "displayname", "Dave")
+    mirror.user_updated("dave", "quota", "1 GB")
+    mirror.user_enabled("dave", False)
+    mirror.member_added("dave", "admin")
+    mirror.member_removed("bob", "admin")
+    mirror.user_deleted("carol")
+    mirror.group_created("new")
+    mirror.group_deleted("empty")
+
+    dave = mirror.get_user("dave")
+    assert (dave.displayname, dave.enabled, dave.groups) == (
+        "Dave",
+        False,
+        ["admin", "names"],
+    )
+    assert mirror.get_user("carol") is None
+    assert mirror.get_group("admin").members == ["dave"]
+    assert mirror.get_group("new").members == []
+    assert mirror.get_group("empty") is None
+
+
+def test_freshness(mirror):
+    assert mirror.is_fresh()
+    mirror.last_refresh -= 61
+    assert not mirror.is_fresh()
+
+    # The last refresh time survives a restart
+    mirror.close()
+    assert not mirror.is_fresh()
+    reopened = DirectoryMirror(mirror.path, max_staleness=120)
+    reopened.open()
+    assert reopened.is_fresh()
+    reopened.close()
+
+
+def test_writes_during_refresh_are_kept(mirror, monkeypatch):
+    async def get_details(limit: int, offset: int) -> list[NCUser]:
+        # The connector provisions while the listing is being read
+        mirror.group_created("new")
+        mirror.member_added("carol", "new")
+        users = [
+            user("bob", ["admin", "names"]),
+            user("Alice", ["names"]),
+            user("carol", ["new"]),
+        ]
+        return users[offset : offset + limit]
+
+    async def get_groups(limit: int, offset: int) -> list[str]:
+        return ["names", "admin", "empty", "new"][offset : offset + limit]
+
+    monkeypatch.setattr(UserAPI, "get_details", get_details)
+    monkeypatch.setattr(GroupAPI, "get", get_groups)
+    mirror.last_refresh -= 61
+    asyncio.run(mirror.refresh())
+
+    assert mirror.is_fresh()
+    assert mirror.get_group("new").members == ["carol"]
+    assert mirror.get_user("carol").groups == ["new"]
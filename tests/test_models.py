@@ -0,0 +1,102 @@
+import json
+
+import orjson
+import pytest
+from scim2_models import Context
+
+from nc_scim.models import NCGroup, NCUser
+
+
+def user(**fields) -> NCUser:
+    return NCUser.model_validate(
+        {
+            "id": "alice",
+            "email": "alice@example.com",
+            "displayname": "Alice",
+            "enabled": True,
+            "groups": ["admin", "names"],
+            **fields,
+        }
+    )
+
+
+def test_scim_round_trip_has_no_diff():
+    alice = user(phone="+12025550123", address="1 Main St")
+    assert not alice.diff(NCUser.from_scim(alice.to_scim()))
+
+
+def test_diff_is_minimal():
+    diff = user().diff(user(enabled=False))
+    assert diff.model_dump() == {
+        "updates": {},
+        "enabled": False,
+        "groups_added": [],
+        "groups_removed": [],
+    }
+
+    diff = user().diff(
+        user(displayname="Alicia", email=None, enabled=None, groups=["names", "new"])
+    )
+    assert diff.updates == {"displayname": "Alicia", "email": ""}
+    assert diff.enabled is None
+    assert (diff.groups_added, diff.groups_removed) == (["new"], ["admin"])
+
+
+def test_trusted_user_has_no_diff_with_mixed_case_email():
+    record = {"id": "bob", "email": "Bob@Example.COM", "enabled": True, "groups": []}
+    bob = NCUser.trusted(record)
+    assert bob.version() == NCUser.model_validate(record).version()
+
+    target = NCUser.from_scim(bob.to_scim())
+    assert not bob.diff(target)
+    diff = bob.diff(target.model_copy(update={"enabled": False}))
+    assert (diff.updates, diff.enabled) == ({}, False)
+
+
+def json_response_body(content) -> bytes:
+    """How `JSONResponse` renders content, which the fast path has to match."""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "resource",
+    [
+        user(phone="+12025550123", address="1 Main St\nSpringfield"),
+        user(email=None, displayname=None, enabled=None, groups=[]),
+        user(displayname="", enabled=False),
+        user(id="zoë", displayname='Zoë 👋 \u2028"quoted"', groups=["ünï", "admin"]),
+        NCGroup(groupid="names", members=["alice", "bob"]),
+        NCGroup(groupid="émpty", members=[]),
+    ],
+)
+def test_scim_dump_matches_to_scim(resource):
+    slow = resource.to_scim().model_dump(scim_ctx=Context.DEFAULT)
+    fast = resource.scim_dump()
+    assert fast == slow
+    assert orjson.dumps(fast) == json_response_body(slow)
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        {"id": "bob", "groups": [], "enabled": False},
+        {
+            "id": "alice",
+            "email": "alice@example.com",
+            "displayname": "Alice",
+            "phone": "+12025550123",
+            "address": "1 Main St",
+            "enabled": True,
+            "groups": "admin",
+            "quota": {"free": 1, "used": 2, "total": 3, "relative": 4, "quota": 5},
+        },
+    ],
+)
+def test_trusted_matches_validated(record):
+    trusted = NCUser.trusted(record)
+    validated = NCUser.model_validate(record)
+    assert trusted == validated
+    assert trusted.scim_dump() == validated.scim_dump()
+    assert trusted.version() == validated.version()
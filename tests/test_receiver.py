@@ -1,21 +1,45 @@
 import json
 
+import httpx
 import pytest
 from environs import env
 from fastapi.testclient import TestClient
 from scim2_models import (
     Group,
     ListResponse,
+    PatchOperation,
     User,
 )
 
-from nc_scim.receiver import app
+from nc_scim import receiver
+from nc_scim.events import directory_events
+from nc_scim.forwarder import GroupAPI, UserAPI
+from nc_scim.membership import MembershipIndex
+from nc_scim.receiver import app, patch_members
 
 env.read_env()
 
 client = TestClient(app, headers={"Authorization": f"Bearer {env.str('SCIM_TOKEN')}"})
 
 
+USER_SCHEMA = "urn:ietf:params:scim:schemas:core:2.0:User"
+
+
+def without_meta(resource: dict) -> dict:
+    """Resource versions are opaque hashes, so they're tested separately from the rest of the data."""
+    resource = {k: v for k, v in resource.items() if k != "meta"}
+    if "Resources" in resource:
+        resource["Resources"] = [without_meta(r) for r in resource["Resources"]]
+    return resource
+
+
+@pytest.fixture(scope="module", autouse=True)
+def lifespan():
+    """Run every test on one event loop, so the forwarder's pooled connections stay usable between requests."""
+    with client:
+        yield
+
+
 #########################################
 # ┌───────────────────────────────────┐ #
 # │    U S E R   E N D P O I N T S    │ #
@@ -37,14 +61,90 @@ client = TestClient(app, headers={"Authorization": f"Bearer {env.str('SCIM_TOKEN
 
 def test_get_all_users_with_groups():
     # fmt: off
-    expected = json.loads('{"schemas":["urn:ietf:params:scim:api:messages:2.0:ListResponse"],"Resources":[{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"admin","userName":"admin","name":{"formatted":"admin"},"displayName":"admin","active":true,"emails":[{"value":"admin@example.net","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"admin","display":"admin","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"alice","userName":"alice","name":{"formatted":"alice"},"displayName":"alice","active":true,"emails":[{"value":"alice@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"bob","userName":"bob","name":{"formatted":"bob"},"displayName":"bob","active":true,"emails":[{"value":"bob@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"jane","userName":"jane","name":{"formatted":"jane"},"displayName":"jane","active":true,"emails":[{"value":"jane@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"john","userName":"john","name":{"formatted":"john"},"displayName":"john","active":true,"emails":[{"value":"john@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"haters","display":"haters","type":"direct"},{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"localhost","userName":"localhost","name":{"formatted":"localhost"},"displayName":"localhost","active":true,"emails":[],"phoneNumbers":[],"addresses":[],"groups":[]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user1","userName":"user1","name":{"formatted":"user1"},"displayName":"user1","active":true,"emails":[{"value":"user1@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"haters","display":"haters","type":"direct"},{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user2","userName":"user2","name":{"formatted":"user2"},"displayName":"user2","active":true,"emails":[{"value":"user2@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user3","userName":"user3","name":{"formatted":"user3"},"displayName":"user3","active":true,"emails":[{"value":"user3@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user4","userName":"user4","name":{"formatted":"user4"},"displayName":"user4","active":true,"emails":[{"value":"user4@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user5","userName":"user5","name":{"formatted":"user5"},"displayName":"user5","active":true,"emails":[{"value":"user5@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user6","userName":"user6","name":{"formatted":"user6"},"displayName":"user6","active":true,"emails":[{"value":"user6@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]}]}')
+    expected = json.loads('{"schemas":["urn:ietf:params:scim:api:messages:2.0:ListResponse"],"totalResults":12,"startIndex":1,"itemsPerPage":12,"Resources":[{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"admin","userName":"admin","name":{"formatted":"admin"},"displayName":"admin","active":true,"emails":[{"value":"admin@example.net","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"admin","display":"admin","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"alice","userName":"alice","name":{"formatted":"alice"},"displayName":"alice","active":true,"emails":[{"value":"alice@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"bob","userName":"bob","name":{"formatted":"bob"},"displayName":"bob","active":true,"emails":[{"value":"bob@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"jane","userName":"jane","name":{"formatted":"jane"},"displayName":"jane","active":true,"emails":[{"value":"jane@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"john","userName":"john","name":{"formatted":"john"},"displayName":"john","active":true,"emails":[{"value":"john@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"haters","display":"haters","type":"direct"},{"value":"names","display":"names","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"localhost","userName":"localhost","name":{"formatted":"localhost"},"displayName":"localhost","active":true,"emails":[],"phoneNumbers":[],"addresses":[],"groups":[]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user1","userName":"user1","name":{"formatted":"user1"},"displayName":"user1","active":true,"emails":[{"value":"user1@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"haters","display":"haters","type":"direct"},{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user2","userName":"user2","name":{"formatted":"user2"},"displayName":"user2","active":true,"emails":[{"value":"user2@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user3","userName":"user3","name":{"formatted":"user3"},"displayName":"user3","active":true,"emails":[{"value":"user3@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user4","userName":"user4","name":{"formatted":"user4"},"displayName":"user4","active":true,"emails":[{"value":"user4@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user5","userName":"user5","name":{"formatted":"user5"},"displayName":"user5","active":true,"emails":[{"value":"user5@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:User"],"id":"user6","userName":"user6","name":{"formatted":"user6"},"displayName":"user6","active":true,"emails":[{"value":"user6@example.com","type":"other","primary":true}],"phoneNumbers":[],"addresses":[],"groups":[{"value":"numbers","display":"numbers","type":"direct"}]}]}')
     # fmt: on
 
-    response = client.get("/Users?attributes=groups")
+    response = client.get("/Users")
     assert response.status_code == 200
     raw_data = response.json()
     users = ListResponse[User].model_validate(raw_data).model_dump()
-    assert users == expected
+    assert without_meta(users) == expected
+
+    # Only the requested attributes are returned, besides those that always are
+    response = client.get("/Users?attributes=groups")
+    assert response.status_code == 200
+    assert response.json()["Resources"] == [
+        {k: u[k] for k in ("schemas", "id", "groups")} for u in expected["Resources"]
+    ]
+
+
+def test_get_users_paginated():
+    response = client.get("/Users?startIndex=2&count=3")
+    assert response.status_code == 200
+    users = ListResponse[User].model_validate(response.json())
+    assert [u.id for u in users.resources] == ["alice", "bob", "jane"]
+    assert users.start_index == 2
+    assert users.items_per_page == 3
+    assert users.total_results == 12
+
+    response = client.get("/Users?startIndex=11&count=5")
+    assert response.status_code == 200
+    users = ListResponse[User].model_validate(response.json())
+    assert [u.id for u in users.resources] == ["user5", "user6"]
+    assert users.total_results == 12
+
+
+def test_get_users_filtered():
+    response = client.get('/Users?filter=userName eq "Alice"')
+    assert response.status_code == 200
+    users = ListResponse[User].model_validate(response.json())
+    assert [u.id for u in users.resources] == ["alice"]
+    assert users.total_results == 1
+
+    response = client.get(
+        '/Users?filter=emails[value ew "@example.com"] and groups.value eq "haters"'
+    )
+    assert response.status_code == 200
+    users = ListResponse[User].model_validate(response.json())
+    assert [u.id for u in users.resources] == ["john", "user1"]
+
+    response = client.get('/Users?filter=userName sw "user"&startIndex=5&count=5')
+    users = ListResponse[User].model_validate(response.json())
+    assert [u.id for u in users.resources] == ["user5", "user6"]
+    assert users.total_results == 6
+
+    # Commas only separate the values of attributes and excludedAttributes
+    response = client.get(
+        '/Users?filter=displayName eq "Doe, John" or userName eq "bob"'
+        "&attributes=userName,displayName"
+    )
+    assert response.status_code == 200
+    assert response.json()["Resources"] == [
+        {"schemas": [USER_SCHEMA], "id": "bob", "userName": "bob", "displayName": "bob"}
+    ]
+
+
+def test_get_users_sorted():
+    response = client.get("/Users?sortBy=userName&sortOrder=descending&count=3")
+    assert response.status_code == 200
+    users = ListResponse[User].model_validate(response.json())
+    assert [u.id for u in users.resources] == ["user6", "user5", "user4"]
+    assert users.total_results == 12
+
+    # Users without an email address come last
+    response = client.get('/Users?sortBy=emails.value&filter=userName co "l"')
+    users = ListResponse[User].model_validate(response.json())
+    assert [u.id for u in users.resources] == ["alice", "localhost"]
+
+
+def test_get_users_invalid_filter():
+    response = client.get('/Users?filter=userName eq "alice" and')
+    assert response.status_code == 400
+    assert response.json()["scimType"] == "invalidFilter"
+
+    response = client.get("/Users", params={"filter": 'userName eq "a\\x"'})
+    assert response.status_code == 400
+    assert response.json()["scimType"] == "invalidFilter"
 
 
 @pytest.mark.dependency()
@@ -62,11 +162,141 @@ def test_create_user():
         headers={"Content-Type": "application/scim+json"},
     )
     assert response.status_code == 201, "Status code is not '201 Created'"
-    assert response.json() == expected_user_data, (
+    assert without_meta(response.json()) == expected_user_data, (
         "User data post-creation does not match what was expected"
     )
 
 
+def test_get_user_etag():
+    response = client.get("/Users/alice")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.json()["meta"]["version"] == etag
+
+    response = client.get("/Users/alice", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    response = client.get("/Users/bob", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_patch_user():
+    def patch(*operations: dict, **headers):
+        return client.patch(
+            "/Users/alice",
+            json={
+                "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+                "Operations": list(operations),
+            },
+            headers=headers,
+        )
+
+    before = client.get("/Users/alice").json()
+
+    response = patch({"op": "replace", "path": "active", "value": False})
+    assert response.status_code == 200
+    assert response.json()["active"] is False
+    assert without_meta(response.json()) == without_meta({**before, "active": False})
+    assert client.get("/Users/alice").json()["active"] is False
+
+    # A stale version is rejected, and nothing changes
+    response = patch(
+        {"op": "replace", "value": {"active": True, "displayName": "Alice"}},
+        **{"If-Match": before["meta"]["version"]},
+    )
+    assert response.status_code == 412
+
+    response = patch(
+        {"op": "replace", "value": {"active": True, "displayName": "Alice"}}
+    )
+    assert response.status_code == 200
+    assert (response.json()["active"], response.json()["displayName"]) == (
+        True,
+        "Alice",
+    )
+
+    response = patch(
+        {"op": "replace", "path": "displayName", "value": before["displayName"]}
+    )
+    assert response.status_code == 200
+    assert without_meta(response.json()) == without_meta(before)
+
+    response = patch({"op": "replace", "path": "userName", "value": "alicia"})
+    assert response.status_code == 400
+
+
+def test_patch_user_changed_in_nextcloud(monkeypatch):
+    client.get("/Users/alice")
+    # A change made in Nextcloud directly, which the connector hasn't heard of
+    with monkeypatch.context() as m:
+        m.setattr(directory_events, "user_updated", lambda *args: None)
+        client.portal.call(UserAPI.update, "alice", "displayname", "Alicia")
+
+    response = client.patch(
+        "/Users/alice",
+        json={
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [{"op": "replace", "path": "displayName", "value": "alice"}],
+        },
+    )
+    assert response.status_code == 200
+    user = client.portal.call(lambda: UserAPI.get("alice", fresh=True))
+    assert user.displayname == "alice"
+
+
+def test_replace_user(monkeypatch):
+    before = client.get("/Users/bob").json()
+    replacement = {
+        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+        "userName": "bob",
+        "displayName": "Robert",
+        "emails": [{"value": "robert@example.com", "primary": True}],
+    }
+
+    response = client.put("/Users/bob", json=replacement)
+    assert response.status_code == 200
+    user = response.json()
+    assert (user["displayName"], user["emails"][0]["value"]) == (
+        "Robert",
+        "robert@example.com",
+    )
+    # Read-only and omitted optional attributes are kept
+    assert (user["groups"], user["active"]) == (before["groups"], True)
+
+    # Replacing with the same data changes nothing
+    response = client.put(
+        "/Users/bob", json=replacement, headers={"If-Match": user["meta"]["version"]}
+    )
+    assert response.status_code == 200
+    assert response.json() == user
+
+    response = client.put("/Users/bob", json={**replacement, "userName": "robert"})
+    assert response.status_code == 400
+
+    response = client.put(
+        "/Users/bob",
+        json={**replacement, "displayName": "bob", "emails": before["emails"]},
+    )
+    assert response.status_code == 200
+    assert without_meta(response.json()) == without_meta(before)
+
+    # A change made in Nextcloud directly, which the connector hasn't heard of
+    with monkeypatch.context() as m:
+        m.setattr(directory_events, "user_updated", lambda *args: None)
+        client.portal.call(UserAPI.update, "bob", "displayname", "Robert")
+
+    response = client.put(
+        "/Users/bob",
+        json={**replacement, "displayName": "bob", "emails": before["emails"]},
+    )
+    assert response.status_code == 200
+    user = client.portal.call(lambda: UserAPI.get("bob", fresh=True))
+    assert user.displayname == "bob"
+
+
 @pytest.mark.dependency(depends=["test_create_user"])
 def test_get_user():
     # fmt: off
@@ -75,7 +305,7 @@ def test_get_user():
     response = client.get("/Users/testuser2")
     assert response.status_code == 200
     user = User.model_validate(response.json()).model_dump()
-    assert user == expected
+    assert without_meta(user) == expected
 
 
 @pytest.mark.dependency(depends=["test_get_user"])
@@ -111,14 +341,302 @@ def test_delete_user():
 
 def test_get_all_groups_with_members():
     # fmt: off
-    expected = json.loads('{"schemas":["urn:ietf:params:scim:api:messages:2.0:ListResponse"],"Resources":[{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"admin","displayName":"admin","members":[{"value":"admin"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"haters","displayName":"haters","members":[{"value":"john"},{"value":"user1"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"names","displayName":"names","members":[{"value":"alice"},{"value":"bob"},{"value":"jane"},{"value":"john"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"numbers","displayName":"numbers","members":[{"value":"user1"},{"value":"user2"},{"value":"user3"},{"value":"user4"},{"value":"user5"},{"value":"user6"}]}]}')
+    expected = json.loads('{"schemas":["urn:ietf:params:scim:api:messages:2.0:ListResponse"],"totalResults":4,"startIndex":1,"itemsPerPage":4,"Resources":[{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"admin","displayName":"admin","members":[{"value":"admin"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"haters","displayName":"haters","members":[{"value":"john"},{"value":"user1"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"names","displayName":"names","members":[{"value":"alice"},{"value":"bob"},{"value":"jane"},{"value":"john"}]},{"schemas":["urn:ietf:params:scim:schemas:core:2.0:Group"],"id":"numbers","displayName":"numbers","members":[{"value":"user1"},{"value":"user2"},{"value":"user3"},{"value":"user4"},{"value":"user5"},{"value":"user6"}]}]}')
     # fmt: on
 
-    response = client.get("/Groups?attributes=members")
+    response = client.get("/Groups")
     assert response.status_code == 200
 
     groups = ListResponse[Group].model_validate(response.json()).model_dump()
-    assert groups == expected
+    assert without_meta(groups) == expected
+
+    response = client.get("/Groups?attributes=members")
+    assert response.status_code == 200
+    assert response.json()["Resources"] == [
+        {k: g[k] for k in ("schemas", "id", "members")} for g in expected["Resources"]
+    ]
+
+
+def test_projection_skips_upstream_reads():
+    response = client.get("/Users?attributes=id,userName&count=3")
+    assert response.status_code == 200
+    assert response.json()["Resources"] == [
+        {"schemas": [USER_SCHEMA], "id": u, "userName": u}
+        for u in ("admin", "alice", "bob")
+    ]
+
+    response = client.get("/Groups?excludedAttributes=members,meta")
+    assert response.status_code == 200
+    assert [g["id"] for g in response.json()["Resources"]] == [
+        "admin",
+        "haters",
+        "names",
+        "numbers",
+    ]
+    assert not any("members" in g for g in response.json()["Resources"])
+
+    response = client.get("/Groups/names?excludedAttributes=members")
+    assert response.status_code == 200
+    assert (response.json()["displayName"], "members" in response.json()) == (
+        "names",
+        False,
+    )
+    response = client.get("/Groups/nope?excludedAttributes=members")
+    assert response.status_code == 404
+
+    # A version to compare with needs the members after all
+    etag = client.get("/Groups/names").headers["ETag"]
+    response = client.get(
+        "/Groups/names?excludedAttributes=members", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    response = client.get("/Users/alice?attributes=emails")
+    assert response.json() == {
+        "schemas": [USER_SCHEMA],
+        "id": "alice",
+        "emails": [{"value": "alice@example.com", "type": "other", "primary": True}],
+    }
+
+
+def test_membership_index(monkeypatch):
+    def sorted_groups(user: dict) -> dict:
+        return {**user, "groups": sorted(user.get("groups", []), key=str)}
+
+    users = client.get("/Users?attributes=userName,groups").json()
+    groups = client.get("/Groups").json()
+
+    index = MembershipIndex(max_staleness=60)
+    client.portal.call(index.refresh)
+    monkeypatch.setattr(receiver, "membership_index", index)
+
+    response = client.get("/Users?attributes=userName,groups")
+    assert response.status_code == 200
+    assert [sorted_groups(u) for u in response.json()["Resources"]] == [
+        sorted_groups(u) for u in users["Resources"]
+    ]
+    assert client.get("/Groups").json() == groups
+    assert client.get("/Groups/haters").json() == next(
+        g for g in groups["Resources"] if g["id"] == "haters"
+    )
+    assert client.get("/Groups/nope").status_code == 404
+
+    # The index knows how many groups there are, so pages don't need them counted upstream
+    async def count() -> int:
+        raise AssertionError("The groups were counted from Nextcloud")
+
+    monkeypatch.setattr(GroupAPI, "count", count)
+    assert client.get("/Groups?count=2").json()["totalResults"] == 4
+
+    # Writes are applied to the index as they happen
+    directory_events.register(index)
+    try:
+        operations = {
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [
+                {"op": "add", "path": "members", "value": [{"value": "bob"}]}
+            ],
+        }
+        client.patch("/Groups/haters", json=operations)
+        assert "haters" in index.groups("bob")
+        operations["Operations"][0]["op"] = "remove"
+        client.patch("/Groups/haters", json=operations)
+        assert "haters" not in index.groups("bob")
+    finally:
+        directory_events.unregister(index)
+
+
+def test_upstream_failure_while_listing_is_an_error(monkeypatch):
+    async def get_members(group_id: str) -> list[str]:
+        if group_id == "numbers":
+            raise httpx.ConnectError("Nextcloud went away")
+        return []
+
+    monkeypatch.setattr(receiver, "mirror", None)
+    monkeypatch.setattr(receiver, "membership_index", None)
+    monkeypatch.setattr(GroupAPI, "get_members", get_members)
+
+    # Not a 200 with a truncated list
+    response = client.get("/Groups")
+    assert response.status_code == 502
+    assert response.json()["schemas"] == ["urn:ietf:params:scim:api:messages:2.0:Error"]
+
+
+@pytest.mark.parametrize("path", ["/Users", "/Groups?count=2", "/Groups?startIndex=9"])
+def test_list_responses_are_streamed_unchanged(path):
+    """Streamed list responses are byte-for-byte what rendering the whole `ListResponse` at once gives."""
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/scim+json"
+
+    body = response.json()
+    resource_type = User if path.startswith("/Users") else Group
+    whole = receiver.ScimJsonResponse(
+        content=ListResponse[resource_type].model_validate(body)
+    )
+    assert response.content == whole.body
+
+
+def test_get_groups_filtered():
+    response = client.get('/Groups?filter=displayName eq "haters"')
+    assert response.status_code == 200
+    groups = ListResponse[Group].model_validate(response.json())
+    assert [(g.id, [m.value for m in g.members]) for g in groups.resources] == [
+        ("haters", ["john", "user1"])
+    ]
+
+    response = client.get('/Groups?filter=members[value eq "john"]')
+    groups = ListResponse[Group].model_validate(response.json())
+    assert [g.id for g in groups.resources] == ["haters", "names"]
+
+
+def test_get_groups_sorted():
+    response = client.get("/Groups?sortBy=displayName&sortOrder=descending")
+    assert response.status_code == 200
+    groups = ListResponse[Group].model_validate(response.json())
+    assert [g.id for g in groups.resources] == ["numbers", "names", "haters", "admin"]
+
+
+def test_group_etag():
+    etag = client.get("/Groups/haters").headers["ETag"]
+    response = client.get("/Groups/haters", headers={"If-None-Match": f'"x", {etag}'})
+    assert response.status_code == 304
+
+    # A stale version can't be used to change the group
+    response = client.patch(
+        "/Groups/haters",
+        json={
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [
+                {"op": "add", "path": "members", "value": [{"value": "bob"}]}
+            ],
+        },
+        headers={"Content-Type": "application/scim+json", "If-Match": 'W/"stale"'},
+    )
+    assert response.status_code == 412
+    response = client.get("/Groups/haters", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_patch_group_members():
+    def patch(*operations: dict):
+        return client.patch(
+            "/Groups/haters",
+            json={
+                "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+                "Operations": list(operations),
+            },
+        )
+
+    def members(response) -> list[str]:
+        assert response.status_code == 200
+        return sorted(m["value"] for m in response.json()["members"])
+
+    before = members(client.get("/Groups/haters"))
+    assert before == ["john", "user1"]
+
+    # Operations apply in order, so bob ends up not being added
+    response = patch(
+        {
+            "op": "add",
+            "path": "members",
+            "value": [{"value": "bob"}, {"value": "jane"}],
+        },
+        {"op": "remove", "path": "members", "value": [{"value": "bob"}]},
+    )
+    assert members(response) == ["jane", "john", "user1"]
+
+    response = patch(
+        {
+            "op": "replace",
+            "path": "members",
+            "value": [{"value": "user1"}, {"value": "user2"}],
+        }
+    )
+    assert members(response) == ["user1", "user2"]
+
+    response = patch({"op": "remove", "path": 'members[value eq "user2"]'})
+    assert members(response) == ["user1"]
+
+    response = patch({"op": "remove", "path": "members"})
+    assert members(response) == []
+
+    response = patch(
+        {"op": "replace", "value": {"members": [{"value": u} for u in before]}}
+    )
+    assert members(response) == before
+
+    response = patch({"op": "replace", "path": "displayName", "value": "Lovers"})
+    assert response.status_code == 400
+
+
+def test_patch_members_are_coalesced():
+    operations = [
+        PatchOperation(
+            op="add",
+            path="members",
+            value=[{"value": "bob"}, {"value": "bob"}, {"value": "john"}],
+        ),
+        PatchOperation(op="remove", path="members", value=[{"value": "alice"}]),
+    ]
+    assert patch_members(["alice", "john"], operations) == ["john", "bob"]
+
+
+def test_patch_group_changed_in_nextcloud(monkeypatch):
+    def patch(*operations: dict):
+        return client.patch(
+            "/Groups/haters",
+            json={
+                "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+                "Operations": list(operations),
+            },
+        )
+
+    def members() -> list[str]:
+        return client.portal.call(lambda: GroupAPI.get_members("haters", fresh=True))
+
+    client.get("/Groups/haters")
+    # A member added in Nextcloud directly, which the connector hasn't heard of
+    with monkeypatch.context() as m:
+        m.setattr(directory_events, "member_added", lambda *args: None)
+        client.portal.call(UserAPI.add_to_group, "bob", "haters")
+
+    response = patch({"op": "remove", "path": "members", "value": [{"value": "bob"}]})
+    assert response.status_code == 200
+    assert members() == ["john", "user1"]
+
+
+def test_patch_without_read_after_write(monkeypatch):
+    monkeypatch.setattr(receiver, "CONNECTOR_SKIP_READ_AFTER_WRITE", True)
+    operations = {
+        "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+        "Operations": [{"op": "add", "path": "members", "value": [{"value": "bob"}]}],
+    }
+
+    # The response is built locally, and matches what a read gives
+    response = client.patch("/Groups/haters", json=operations)
+    assert response.status_code == 204
+    assert response.content == b""
+    group = client.get("/Groups/haters")
+    assert group.headers["ETag"] == response.headers["ETag"]
+
+    operations["Operations"][0]["op"] = "remove"
+    response = client.patch(
+        "/Groups/haters", json=operations, params={"attributes": "displayName"}
+    )
+    assert response.status_code == 200
+    assert "members" not in response.json()
+    assert response.json()["displayName"] == "haters"
+
+    response = client.patch(
+        "/Users/alice",
+        json={
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [{"op": "replace", "path": "displayName", "value": "alice"}],
+        },
+    )
+    assert response.status_code == 204
+    assert client.get("/Users/alice").headers["ETag"] == response.headers["ETag"]
 
 
 def test_get_group_by_id():
@@ -130,7 +648,7 @@ def test_get_group_by_id():
     assert response.status_code == 200
 
     group = Group.model_validate(response.json()).model_dump()
-    assert group == expected
+    assert without_meta(group) == expected
 
 
 @pytest.mark.dependency()
@@ -145,7 +663,7 @@ def test_create_group():
     assert response.status_code == 201
 
     group = Group.model_validate(response.json()).model_dump()
-    assert group == expected
+    assert without_meta(group) == expected
 
 
 @pytest.mark.dependency(depends=["test_create_group"])
@@ -155,3 +673,94 @@ def test_delete_group():
 
     response = client.get("/Groups/test2")
     assert response.status_code == 404
+
+
+#########################################
+# ┌───────────────────────────────────┐ #
+# │    B U L K   E N D P O I N T      │ #
+# └───────────────────────────────────┘ #
+#########################################
+
+
+def test_bulk():
+    response = client.post(
+        "/Bulk",
+        json={
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:BulkRequest"],
+            "Operations": [
+                {
+                    "method": "PATCH",
+                    "path": "/Groups/bulkId:group",
+                    "data": {
+                        "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+                        "Operations": [
+                            {
+                                "op": "add",
+                                "path": "members",
+                                "value": [{"value": "bulkId:user"}],
+                            }
+                        ],
+                    },
+                },
+                {
+                    "method": "POST",
+                    "path": "/Users",
+                    "bulkId": "user",
+                    "data": {
+                        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+                        "userName": "bulkuser",
+                        "displayName": "Bulk User",
+                        "emails": [{"value": "bulkuser@example.com"}],
+                    },
+                },
+                {
+                    "method": "POST",
+                    "path": "/Groups",
+                    "bulkId": "group",
+                    "data": {
+                        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:Group"],
+                        "displayName": "bulkgroup",
+                    },
+                },
+                {"method": "DELETE", "path": "/Users/nobody"},
+            ],
+        },
+        headers={"Content-Type": "application/scim+json"},
+    )
+    assert response.status_code == 200
+    operations = response.json()["Operations"]
+    assert [o["status"] for o in operations] == ["200", "201", "201", "404"]
+    assert operations[1]["location"].endswith("/Users/bulkuser")
+    assert operations[0]["version"] == client.get("/Groups/bulkgroup").headers["ETag"]
+
+    group = Group.model_validate(client.get("/Groups/bulkgroup").json())
+    assert [m.value for m in group.members] == ["bulkuser"]
+
+    response = client.post(
+        "/Bulk",
+        json={
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:BulkRequest"],
+            "Operations": [
+                {"method": "DELETE", "path": "/Users/bulkuser"},
+                {"method": "DELETE", "path": "/Groups/bulkgroup"},
+            ],
+        },
+        headers={"Content-Type": "application/scim+json"},
+    )
+    assert [o["status"] for o in response.json()["Operations"]] == ["204", "204"]
+
+
+def test_bulk_limits():
+    config = client.get("/ServiceProviderConfig").json()["bulk"]
+    assert config["supported"]
+
+    response = client.post(
+        "/Bulk",
+        json={
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:BulkRequest"],
+            "Operations": [{"method": "DELETE", "path": "/Users/nobody"}]
+            * (config["maxOperations"] + 1),
+        },
+        headers={"Content-Type": "application/scim+json"},
+    )
+    assert response.status_code == 413
@@ -0,0 +1,60 @@
+from nc_scim.models import NCGroup, NCUser
+from nc_scim.records import GroupRecord, NameTable, UserRecord
+
+
+def test_user_round_trip():
+    names = NameTable()
+    user = NCUser.model_validate(
+        {
+            "id": "alice",
+            "email": "alice@example.com",
+            "displayname": "Alice",
+            "enabled": False,
+            "groups": ["names", "admin"],
+            "quota": {"free": 1, "used": 2, "total": 3, "relative": 4, "quota": 5},
+            "phone": "+12025550123",
+            "address": "1 Main St",
+            "backend": "Database",
+            "backendCapabilities": {"setDisplayName": True},
+        }
+    )
+    record = UserRecord.pack(user, names)
+    assert record.unpack(names) == user
+    assert record.unpack(names).model_extra == user.model_extra
+    assert record.in_group("admin", names)
+    assert not record.in_group("other", names)
+
+    bare = NCUser.model_validate({"id": "bob"})
+    assert UserRecord.pack(bare, names).unpack(names) == bare
+
+
+def test_names_are_shared():
+    names = NameTable()
+    group = GroupRecord.pack(NCGroup(groupid="names", members=["bob", "alice"]), names)
+    user = UserRecord.pack(
+        NCUser.model_validate({"id": "bob", "groups": ["names"]}), names
+    )
+
+    assert group.unpack(names) == NCGroup(groupid="names", members=["bob", "alice"])
+    assert group.has_member("alice", names)
+    assert not group.has_member("carol", names)
+    assert len(names) == 3
+    assert names.name(user.groups[0]) == "names"
+
+
+def test_compaction_reclaims_unused_names():
+    names = NameTable()
+    group = GroupRecord.pack(NCGroup(groupid="names", members=["bob", "alice"]), names)
+    user = UserRecord.pack(
+        NCUser.model_validate({"id": "carol", "groups": ["admin", "names"]}), names
+    )
+    # alice is no longer referenced by anything
+    group = GroupRecord.pack(NCGroup(groupid="names", members=["bob"]), names)
+
+    ids = names.compact([*group.members, *user.groups])
+    group.remap(ids)
+    user.remap(ids)
+    assert len(names) == 3
+    assert names.find("alice") is None
+    assert group.member_ids(names) == ["bob"]
+    assert user.unpack(names).groups == ["admin", "names"]
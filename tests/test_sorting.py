@@ -0,0 +1,27 @@
+from nc_scim.sorting import sort_resources, sort_value
+
+USERS = [
+    {
+        "id": "b",
+        "userName": "bob",
+        "emails": [{"value": "z@x"}, {"value": "B@x", "primary": True}],
+    },
+    {"id": "a", "userName": "Alice", "emails": [{"value": "c@x"}]},
+    {"id": "c", "userName": "carol"},
+]
+
+
+def test_sort_value():
+    assert sort_value(USERS[0], "emails") == "b@x"
+    assert sort_value(USERS[0], "emails.value") == "b@x"
+    assert sort_value(USERS[1], "username") == "alice"
+    assert sort_value(USERS[2], "emails.value") is None
+
+
+def test_sort_resources():
+    def ids(users):
+        return [u["id"] for u in users]
+
+    assert ids(sort_resources(USERS, "username", False, dict)) == ["a", "b", "c"]
+    assert ids(sort_resources(USERS, "emails", False, dict)) == ["b", "a", "c"]
+    assert ids(sort_resources(USERS, "emails", True, dict)) == ["c", "a", "b"]
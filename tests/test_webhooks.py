@@ -0,0 +1,175 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from nc_scim import forwarder, receiver
+from nc_scim.cache import TTLCache
+from nc_scim.events import DirectoryListener, directory_events
+from nc_scim.forwarder import NCAPIException, NCStatusCode, UserAPI
+from nc_scim.mirror import DirectoryMirror
+from nc_scim.models import NCUser
+from nc_scim.receiver import app
+from nc_scim.records import UserRecord
+
+SECRET = "webhook-secret"
+
+client = TestClient(app)
+
+
+class Recorder(DirectoryListener):
+    """Records every change it is told of, as `(method, *args)`."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattribute__(self, name):
+        if name in DirectoryListener.__dict__ and not name.startswith("_"):
+            return lambda *args: self.calls.append((name, *args))
+        return super().__getattribute__(name)
+
+
+def emit(event_class: str, secret: str = SECRET, **fields):
+    """Send an event the way Nextcloud's webhook_listeners app does."""
+    return client.post(
+        "/Webhooks/Nextcloud",
+        headers={"Authorization": f"Bearer {secret}"},
+        json={
+            "user": {"uid": "admin", "displayName": "admin"},
+            "time": 1700000000,
+            "event": {"class": event_class, **fields},
+        },
+    )
+
+
+@pytest.fixture(scope="module", autouse=True)
+def lifespan():
+    with client:
+        yield
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    """Records the changes the webhook applies, with Nextcloud reads stubbed out, so no Nextcloud is needed."""
+
+    async def get_user(user_id: str) -> NCUser:
+        if user_id != "alice":
+            raise NCAPIException(NCStatusCode(404, 404, "user does not exist"))
+        return NCUser(id="alice", displayname="alice", enabled=True)
+
+    monkeypatch.setattr(UserAPI, "get", get_user)
+    monkeypatch.setattr(receiver, "CONNECTOR_WEBHOOK_SECRET", SECRET)
+    r = Recorder()
+    directory_events.register(r)
+    yield r
+    directory_events.unregister(r)
+
+
+def test_webhook_requires_secret(recorder, monkeypatch):
+    assert (
+        emit("OCP\\Group\\Events\\GroupCreatedEvent", secret="nope").status_code == 401
+    )
+    assert client.post("/Webhooks/Nextcloud", json={}).status_code == 401
+
+    monkeypatch.setattr(receiver, "CONNECTOR_WEBHOOK_SECRET", "")
+    assert emit("OCP\\Group\\Events\\GroupCreatedEvent").status_code == 404
+    assert recorder.calls == []
+
+
+def test_events_are_applied(recorder):
+    alice = {"uid": "alice", "displayName": "alice"}
+    names = {"gid": "names", "displayName": "names"}
+
+    responses = [
+        emit("OCP\\User\\Events\\UserCreatedEvent", user=alice),
+        emit(
+            "OCP\\User\\Events\\UserChangedEvent",
+            user=alice,
+            feature="displayName",
+            value="Alice",
+            oldValue="alice",
+        ),
+        emit(
+            "OCP\\User\\Events\\UserChangedEvent",
+            user=alice,
+            feature="enabled",
+            value=False,
+            oldValue=True,
+        ),
+        emit("OCP\\Group\\Events\\UserAddedEvent", user=alice, group=names),
+        emit("OCP\\Group\\Events\\UserRemovedEvent", user=alice, group=names),
+        emit("OCP\\Group\\Events\\GroupCreatedEvent", group=names),
+        emit("OCP\\Group\\Events\\GroupDeletedEvent", gid="names"),
+        emit("OCP\\User\\Events\\UserDeletedEvent", user=alice),
+        emit("OCP\\User\\Events\\PasswordUpdatedEvent", user=alice),
+    ]
+    assert [r.status_code for r in responses] == [204] * len(responses)
+
+    (created, *rest) = recorder.calls
+    assert created[0] == "user_created" and created[1].id == "alice"
+    assert rest == [
+        ("user_updated", "alice", "displayname", "Alice"),
+        ("user_enabled", "alice", False),
+        ("member_added", "alice", "names"),
+        ("member_removed", "alice", "names"),
+        ("group_created", "names"),
+        ("group_deleted", "names"),
+        ("user_deleted", "alice"),
+    ]
+
+
+def test_users_deleted_before_their_creation_event_are_skipped(recorder):
+    response = emit("OCP\\User\\Events\\UserCreatedEvent", user={"uid": "gone"})
+    assert response.status_code == 204
+    assert recorder.calls == []
+
+
+def test_events_invalidate_the_cache(recorder, monkeypatch):
+    monkeypatch.setattr(forwarder, "user_cache", TTLCache(30, 100))
+    forwarder.user_cache.set("alice", UserRecord.pack(NCUser(id="alice")))
+
+    response = emit(
+        "OCP\\User\\Events\\UserChangedEvent",
+        user={"uid": "alice"},
+        feature="avatar",
+        value=None,
+    )
+    assert response.status_code == 204
+    assert forwarder.user_cache.get("alice") is None
+
+
+def test_created_users_are_mirrored_as_read(recorder, monkeypatch, tmp_path):
+    alice = NCUser(
+        id="alice",
+        displayname="Alice",
+        enabled=False,
+        phone="+12025550123",
+        address="1 Main St",
+    )
+
+    async def get_user(user_id: str) -> NCUser:
+        return alice
+
+    monkeypatch.setattr(UserAPI, "get", get_user)
+    mirror = DirectoryMirror(str(tmp_path / "mirror.db"), max_staleness=60)
+    mirror.open()
+    directory_events.register(mirror)
+    try:
+        response = emit("OCP\\User\\Events\\UserCreatedEvent", user={"uid": "alice"})
+        assert response.status_code == 204
+        assert mirror.get_user("alice") == alice
+    finally:
+        directory_events.unregister(mirror)
+        mirror.close()
+
+
+def test_malformed_events_are_rejected(recorder):
+    assert (
+        emit("OCP\\Group\\Events\\UserAddedEvent", user={"uid": "alice"}).status_code
+        == 400
+    )
+    response = client.post(
+        "/Webhooks/Nextcloud",
+        headers={"Authorization": f"Bearer {SECRET}"},
+        json={"time": 1700000000},
+    )
+    assert response.status_code == 400
+    assert recorder.calls == []